@@ -1 +1 @@
-from .function_calling_test_suite import FunctionDefinition, ExpectedFunctionCall, ExpectedFunctionCallGroup, Actual, ActualFunctionCall, TestCase
+from .function_calling_test_suite import FunctionDefinition, ExpectedFunctionCall, ExpectedFunctionCallGroup, Actual, ActualFunctionCall, TurnMetrics, TestCase
@@ -0,0 +1,195 @@
+import time
+from typing import Dict, List, Optional
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+
+class ToolCallAssembly:
+    __slots__ = ("index", "id", "name", "fragments", "complete")
+
+    def __init__(self, index: int, id: Optional[str], name: str, arguments: str):
+        self.index = index
+        self.id = id
+        self.name = name
+        self.fragments = [arguments]
+        # Set once a later tool call starts or the choice finishes, i.e. no more argument fragments will arrive
+        self.complete = False
+
+    @property
+    def arguments(self) -> str:
+        if len(self.fragments) > 1:
+            self.fragments = ["".join(self.fragments)]
+        return self.fragments[0]
+
+
+class ChoiceAssembly:
+    __slots__ = ("index", "role", "fragments", "finish_reason", "tool_calls", "last_tool_call")
+
+    def __init__(self, index: int, role: str, content: str, finish_reason: Optional[str]):
+        self.index = index
+        self.role = role
+        self.fragments = [content]
+        self.finish_reason = finish_reason
+        self.tool_calls: Optional[Dict[int, ToolCallAssembly]] = None
+        self.last_tool_call: Optional[ToolCallAssembly] = None
+
+    @property
+    def content(self) -> str:
+        if len(self.fragments) > 1:
+            self.fragments = ["".join(self.fragments)]
+        return self.fragments[0]
+
+    def complete_tool_calls(self):
+        for tool_call in (self.tool_calls or {}).values():
+            tool_call.complete = True
+
+
+class ChatCompletionAssembler:
+    """
+    Incrementally assembles streamed chat completion chunks into a ChatCompletion.
+
+    Content and argument fragments are collected in lists and joined once, and the partially assembled choices and
+    tool calls can be inspected between chunks.
+    """
+
+    def __init__(self):
+        self.id = ""
+        self.model = ""
+        self.system_fingerprint = ""
+        self.choices: Dict[int, ChoiceAssembly] = {}
+        self.usage: Optional[CompletionUsage] = None
+
+    def add(self, chunk: Optional[ChatCompletionChunk]):
+        if chunk is None:
+            return
+
+        self.id = self.id or chunk.id
+        self.model = self.model or chunk.model
+        self.system_fingerprint = self.system_fingerprint or chunk.system_fingerprint
+        # Sent in a final chunk without choices when requested with stream_options.include_usage
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            self.usage = usage
+
+        for choice in chunk.choices or []:
+            if choice is None or choice.delta is None:
+                continue
+
+            delta = choice.delta
+            assembly = self.choices.get(choice.index)
+            if assembly is None:
+                assembly = self.choices[choice.index] = ChoiceAssembly(
+                    choice.index,
+                    delta.role or "",
+                    delta.content or "",
+                    choice.finish_reason,
+                )
+            else:
+                if delta.content:
+                    assembly.fragments.append(delta.content)
+                assembly.finish_reason = choice.finish_reason
+
+            if delta.tool_calls is not None:
+                self.add_tool_calls(assembly, delta.tool_calls)
+
+            if choice.finish_reason is not None:
+                assembly.complete_tool_calls()
+
+    @staticmethod
+    def add_tool_calls(assembly: ChoiceAssembly, tool_call_deltas):
+        for response_call in tool_call_deltas:
+            if assembly.tool_calls is None:
+                assembly.tool_calls = {}
+
+            arguments = ""
+            name = ""
+            if response_call.function is not None:
+                arguments = response_call.function.arguments or ""
+                name = response_call.function.name or ""
+
+            last = assembly.last_tool_call
+            if last is not None and last.index == response_call.index:
+                if arguments:
+                    last.fragments.append(arguments)
+                continue
+
+            tool_call = assembly.tool_calls.get(response_call.index)
+            if tool_call is not None:
+                if arguments:
+                    tool_call.fragments.append(arguments)
+                assembly.last_tool_call = tool_call
+                continue
+
+            if last is not None:
+                last.complete = True
+
+            tool_call = ToolCallAssembly(response_call.index, response_call.id, name, arguments)
+            assembly.tool_calls[response_call.index] = tool_call
+            assembly.last_tool_call = tool_call
+
+    def choice(self, index: int = 0) -> Optional[ChoiceAssembly]:
+        return self.choices.get(index)
+
+    def tool_calls(self, index: int = 0) -> List[ToolCallAssembly]:
+        assembly = self.choices.get(index)
+        if assembly is None or assembly.tool_calls is None:
+            return []
+
+        return [assembly.tool_calls[call_index] for call_index in sorted(assembly.tool_calls.keys())]
+
+    def to_dict(self) -> Dict:
+        choices = []
+        for index in sorted(self.choices.keys()):
+            assembly = self.choices[index]
+            choice = {
+                "index": assembly.index,
+                "message": {
+                    "role": assembly.role,
+                    "content": assembly.content,
+                },
+                "finish_reason": assembly.finish_reason,
+            }
+            if assembly.tool_calls is not None:
+                choice["message"]["tool_calls"] = [
+                    {
+                        "id": tool_call.id,
+                        "type": "function",
+                        "function": {
+                            "arguments": tool_call.arguments,
+                            "name": tool_call.name,
+                        }
+                    }
+                    for tool_call in self.tool_calls(index)
+                ]
+            choices.append(choice)
+
+        completion = dict(
+            id=self.id,
+            created=int(time.time()),
+            object="chat.completion",
+            model=self.model,
+            choices=choices,
+            system_fingerprint=self.system_fingerprint
+        )
+        if self.usage is not None:
+            completion["usage"] = self.usage.model_dump(mode="json")
+
+        return completion
+
+    def snapshot(self) -> Dict:
+        # What has been received so far, for reporting streams that were abandoned before they finished.
+        # Unlike finalize, this isn't validated, since a partial choice has no finish reason yet.
+        def prune(value):
+            if isinstance(value, dict):
+                return {k: prune(v) for k, v in value.items() if v is not None}
+            if isinstance(value, list):
+                return [prune(v) for v in value]
+            return value
+
+        return prune(self.to_dict())
+
+    def finalize(self) -> ChatCompletion:
+        for assembly in self.choices.values():
+            assembly.complete_tool_calls()
+
+        return ChatCompletion(**self.to_dict())
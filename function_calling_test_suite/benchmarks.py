@@ -0,0 +1,335 @@
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import timeit
+from typing import Any, Callable, Dict, List, Optional
+from openai.types.chat import ChatCompletionChunk, ChatCompletionMessageToolCall
+from .function_calling_test_suite import TestCase
+from .conversation import to_chat_completion
+from .matching import ExpectedCalls, ParsedToolCall
+from .results_store import ResultsStore
+from .spec_cache import SpecCache, load_test_cases
+from .spec_generator import GeneratorConfig, SpecGenerator, write_spec_files
+
+# A benchmark is set up once with a scratch directory, and returns the function that is timed
+Benchmark = Callable[[str], Callable[[], Any]]
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+DEFAULT_BASELINE = "benchmarks/baseline.json"
+
+
+def benchmark(name: str):
+    def register(setup: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def stream_chunks(content_chunks: int, tool_calls: int, argument_chunks: int) -> List[ChatCompletionChunk]:
+    # A streamed response like the stand-in model sends, with content followed by chunked tool call arguments
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> ChatCompletionChunk:
+        return ChatCompletionChunk.model_validate({
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "benchmark",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        })
+
+    chunks = [chunk({"role": "assistant", "content": ""})]
+    chunks += [chunk({"content": f"word{index} "}) for index in range(content_chunks)]
+    for index in range(tool_calls):
+        arguments = json.dumps({"param1": "x" * 8 * argument_chunks})
+        parts = [arguments[start:start + 8] for start in range(0, len(arguments), 8)]
+        for part_index, part in enumerate(parts):
+            delta = {"index": index, "function": {"arguments": part}}
+            if part_index == 0:
+                delta.update(id=f"call_{index}", type="function")
+                delta["function"]["name"] = f"func{index}"
+            chunks.append(chunk({"tool_calls": [delta]}))
+    chunks.append(chunk({}, "tool_calls"))
+    return chunks
+
+
+@benchmark("stream_content")
+def stream_content(scratch: str) -> Callable[[], Any]:
+    chunks = stream_chunks(content_chunks=500, tool_calls=0, argument_chunks=0)
+    return lambda: to_chat_completion(iter(chunks))
+
+
+@benchmark("stream_tool_calls")
+def stream_tool_calls(scratch: str) -> Callable[[], Any]:
+    chunks = stream_chunks(content_chunks=0, tool_calls=8, argument_chunks=60)
+    return lambda: to_chat_completion(iter(chunks))
+
+
+def tool_calls_in_order(test_case: TestCase, shuffle: random.Random) -> List[ChatCompletionMessageToolCall]:
+    # The tool calls of a model that makes every required call, with every any_order group shuffled
+    calls = []
+    for expected in test_case.expected_function_calls:
+        if hasattr(expected, "any_order"):
+            group = [call for call in expected.any_order if not call.optional]
+            shuffle.shuffle(group)
+            calls += group
+        elif not expected.optional:
+            calls.append(expected)
+    return [
+        ChatCompletionMessageToolCall(
+            id=f"call_{index}",
+            type="function",
+            function={"name": call.name, "arguments": json.dumps(call.arguments)},
+        )
+        for index, call in enumerate(calls)
+    ]
+
+
+def match_all(test_cases: List[TestCase], tool_calls: List[List[ChatCompletionMessageToolCall]]):
+    for test_case, calls in zip(test_cases, tool_calls):
+        expected_calls = ExpectedCalls(test_case.expected_function_calls)
+        call_index = 0
+        for call in calls:
+            _, call_index = expected_calls.match(ParsedToolCall.parse(call), call_index)
+            call_index += 1
+
+
+@benchmark("match_sequences")
+def match_sequences(scratch: str) -> Callable[[], Any]:
+    config = GeneratorConfig(functions=8, parameters=3, depth=2, chain_length=10, groups=2, group_width=4,
+                             optional_rate=0.2, seed=1)
+    test_cases = list(SpecGenerator(config).test_cases(200))
+    shuffle = random.Random(1)
+    tool_calls = [tool_calls_in_order(test_case, shuffle) for test_case in test_cases]
+    return lambda: match_all(test_cases, tool_calls)
+
+
+@benchmark("match_wide_group")
+def match_wide_group(scratch: str) -> Callable[[], Any]:
+    config = GeneratorConfig(functions=20, parameters=3, depth=2, chain_length=1, groups=1, group_width=2000, seed=1)
+    test_cases = list(SpecGenerator(config).test_cases(1))
+    tool_calls = [tool_calls_in_order(test_cases[0], random.Random(1))]
+    return lambda: match_all(test_cases, tool_calls)
+
+
+@benchmark("parse_yaml")
+def parse_yaml(scratch: str) -> Callable[[], Any]:
+    config = GeneratorConfig(functions=8, parameters=3, depth=2, chain_length=6, groups=1, group_width=3, seed=1)
+    documents = list(SpecGenerator(config).documents(500))
+
+    def parse():
+        # parse_yaml replaces the expected calls of the document, so it gets a copy of the top level
+        for document in documents:
+            TestCase.parse_yaml({**document, "expected_function_calls": list(document["expected_function_calls"])})
+
+    return parse
+
+
+def spec_dir(scratch: str) -> str:
+    path = os.path.join(scratch, "specs")
+    if not os.path.isdir(path):
+        config = GeneratorConfig(functions=6, parameters=3, depth=2, chain_length=4, groups=1, group_width=3, seed=1)
+        write_spec_files(SpecGenerator(config).documents(400), path, specs_per_file=50)
+    return path
+
+
+@benchmark("load_test_cases")
+def load_specs(scratch: str) -> Callable[[], Any]:
+    path = spec_dir(scratch)
+    return lambda: load_test_cases(3, "*", path, False, False)
+
+
+@benchmark("load_test_cases_cached")
+def load_specs_cached(scratch: str) -> Callable[[], Any]:
+    path = spec_dir(scratch)
+    cache_dir = os.path.join(scratch, "spec_cache")
+    warm = SpecCache(cache_dir)
+    load_test_cases(3, "*", path, False, False, warm)
+    warm.close()
+    return lambda: load_test_cases(3, "*", path, False, False, SpecCache(cache_dir))
+
+
+def results_store(scratch: str) -> str:
+    # A long history: every session reran every spec for every model
+    path = os.path.join(scratch, "results.db")
+    if os.path.exists(path):
+        return path
+
+    rng = random.Random(1)
+    specs = [
+        {"test_id": f"synthetic_{index // 100:04d}.yaml-{index % 100}", "categories": "synthetic, sequenced",
+         "description": "Synthetic spec", "prompt": "Call func1"}
+        for index in range(500)
+    ]
+    store = ResultsStore(path)
+    try:
+        for session in range(20):
+            runs = []
+            for model in ("model-a", "model-b", "model-c", "model-d"):
+                for spec in specs:
+                    for run in range(3):
+                        turns = [{"target": "model", "started": 0.0, "latency": rng.uniform(0.1, 2.0),
+                                  "time_to_first_chunk": rng.uniform(0.05, 0.5), "prompt_tokens": 200,
+                                  "completion_tokens": 40} for _ in range(3)]
+                        runs.append({
+                            "model": model,
+                            "test_id": spec["test_id"],
+                            "run_id": f"{spec['test_id']}-{run}",
+                            "outcome": rng.choice(["PASSED", "PASSED", "FAILED", "ERROR"]),
+                            "start": 0.0,
+                            "stop": 1.0,
+                            "turns": turns,
+                        })
+            store.record_session(specs, runs)
+    finally:
+        store.close()
+    return path
+
+
+@benchmark("aggregate_csv")
+def aggregate_csv(scratch: str) -> Callable[[], Any]:
+    path = results_store(scratch)
+
+    def export():
+        # What pytest_sessionfinish does after recording the session's runs
+        store = ResultsStore(path)
+        try:
+            store.export_summary_csv(os.path.join(scratch, "aggregate_summary.csv"))
+            store.export_latency_csv(os.path.join(scratch, "aggregate_latency.csv"))
+        finally:
+            store.close()
+
+    return export
+
+
+@benchmark("plot_scores")
+def plot_scores(scratch: str) -> Callable[[], Any]:
+    # Imported here, as plotly and pandas take a while to import
+    from .plot_results import load_results, score_models, score_table
+
+    csv_path = os.path.join(scratch, "plot_summary.csv")
+    store = ResultsStore(results_store(scratch))
+    try:
+        store.export_summary_csv(csv_path)
+    finally:
+        store.close()
+    return lambda: score_models(score_table(load_results(csv_path)))
+
+
+def measure(function: Callable[[], Any], repeat: int) -> float:
+    # The fastest of repeat rounds, each long enough to time reliably, in seconds per call
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run_benchmarks(names: List[str], repeat: int) -> Dict[str, float]:
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        for name in names:
+            function = BENCHMARKS[name](scratch)
+            results[name] = measure(function, repeat)
+            print(f"{name:<24} {format_time(results[name])}", file=sys.stderr, flush=True)
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+    # Returns the benchmarks that are more than threshold slower than their baseline
+    regressions = []
+    print(f"{'benchmark':<24} {'time':>10} {'baseline':>10} {'change':>8}")
+    for name, seconds in results.items():
+        if name not in baseline:
+            print(f"{name:<24} {format_time(seconds):>10} {'-':>10} {'-':>8}")
+            continue
+
+        change = seconds / baseline[name] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<24} {format_time(seconds):>10} {format_time(baseline[name]):>10} {change:>+8.1%}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def load_baseline(path: str) -> Dict[str, float]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)["benchmarks"]
+
+
+def save_baseline(path: str, results: Dict[str, float]):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Merged into the existing baseline, so baselines of benchmarks that weren't run are kept
+    benchmarks = {**load_baseline(path), **results}
+    with open(path, "w") as file:
+        json.dump({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created": time.time(),
+            "benchmarks": benchmarks,
+        }, file, indent=2)
+        file.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of the suite against a stored baseline")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="JSON file of baseline timings to compare with")
+    parser.add_argument("--threshold", default=0.25, type=float, help="Slowdown over the baseline that fails")
+    parser.add_argument("--filter", default="*", help="Only run the benchmarks whose name matches this glob")
+    parser.add_argument("--repeat", default=5, type=int, help="Number of timed rounds, of which the fastest is used")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the timings as the new baseline")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit")
+    parser.add_argument(
+        "--allow-missing-baseline",
+        action="store_true",
+        help="Only print the timings of benchmarks without a baseline instead of failing",
+    )
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if fnmatch.fnmatch(name, args.filter)]
+    if args.list:
+        print("\n".join(names))
+        return
+
+    # Checked before running, so a gate without a baseline fails right away rather than passing on nothing
+    baseline = load_baseline(args.baseline)
+    missing = [name for name in names if name not in baseline]
+    if missing and not args.save_baseline and not args.allow_missing_baseline:
+        print(
+            f"No baseline for {', '.join(missing)} in {args.baseline}, run with --save-baseline to store one or "
+            f"--allow-missing-baseline to only time them",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+
+    results = run_benchmarks(names, args.repeat)
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Saved the baseline of {len(results)} benchmarks to {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} benchmarks regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from pydantic import BaseModel
+
+DATA_FILE = "interactions.jsonl"
+INDEX_FILE = "index.json"
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+def canonical_request(namespace: str, request: Dict[str, Any]) -> str:
+    # The timeout doesn't affect what the model returns, so it's left out of the request identity
+    def default(value):
+        if isinstance(value, BaseModel):
+            return value.model_dump(mode="json")
+        return str(value)
+
+    return json.dumps(
+        [namespace, {k: v for k, v in request.items() if k != "timeout"}],
+        sort_keys=True,
+        default=default,
+    )
+
+
+class Cassette:
+    """
+    On-disk store of chat completion interactions for recording and replaying sessions.
+
+    Interactions are appended to interactions.jsonl, and index.json maps the hash of each request to the offsets
+    of its recorded responses. Identical requests are replayed in the order they were recorded. A shared cassette is
+    recorded to by several processes at once, so its index is rebuilt from interactions.jsonl when it's closed.
+    """
+
+    def __init__(self, directory: str, replay: bool = False, shared: bool = False):
+        self.directory = directory
+        self.replay = replay
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.index: Dict[str, List[List[int]]] = defaultdict(list)
+        self.replayed: Dict[str, int] = defaultdict(int)
+
+        os.makedirs(directory, exist_ok=True)
+        data_path = os.path.join(directory, DATA_FILE)
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as index_file:
+                self.index.update(json.load(index_file))
+        elif os.path.exists(data_path):
+            self.rebuild_index(data_path)
+
+        if replay and not self.index:
+            raise CassetteMiss(f"No recorded interactions found in {directory}")
+
+        self.data = open(data_path, "rb" if replay else "ab+")
+
+    def rebuild_index(self, data_path: str):
+        self.index.clear()
+        with open(data_path, "rb") as data:
+            offset = 0
+            for line in data:
+                if line.strip():
+                    self.index[json.loads(line)["key"]].append([offset, len(line)])
+                offset += len(line)
+
+    @staticmethod
+    def key(namespace: str, request: Dict[str, Any]) -> str:
+        return hashlib.sha256(canonical_request(namespace, request).encode("utf-8")).hexdigest()
+
+    def record(
+            self,
+            namespace: str,
+            request: Dict[str, Any],
+            headers: Dict[str, str],
+            response: Optional[ChatCompletion] = None,
+            chunks: Optional[List[ChatCompletionChunk]] = None,
+    ):
+        key = self.key(namespace, request)
+        interaction = {
+            "key": key,
+            "request": json.loads(canonical_request(namespace, request))[1],
+            "headers": headers,
+        }
+        if chunks is not None:
+            interaction["chunks"] = [chunk.model_dump(mode="json") for chunk in chunks]
+        else:
+            interaction["response"] = response.model_dump(mode="json")
+
+        line = (json.dumps(interaction) + "\n").encode("utf-8")
+        with self.lock:
+            self.data.seek(0, os.SEEK_END)
+            offset = self.data.tell()
+            self.data.write(line)
+            self.data.flush()
+            self.index[key].append([offset, len(line)])
+
+    def lookup(self, namespace: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        key = self.key(namespace, request)
+        with self.lock:
+            entries = self.index.get(key)
+            if not entries:
+                raise CassetteMiss(f"No recorded {namespace} response for request {key}")
+
+            # Cycle through the recorded responses when a request is replayed more often than it was recorded
+            offset, length = entries[self.replayed[key] % len(entries)]
+            self.replayed[key] += 1
+            self.data.seek(offset)
+            return json.loads(self.data.read(length))
+
+    def close(self):
+        with self.lock:
+            self.data.close()
+            if not self.replay:
+                if self.shared:
+                    self.rebuild_index(os.path.join(self.directory, DATA_FILE))
+
+                temporary_path = os.path.join(self.directory, f"{INDEX_FILE}.{os.getpid()}.tmp")
+                with open(temporary_path, "w") as index_file:
+                    json.dump(self.index, index_file)
+                os.replace(temporary_path, os.path.join(self.directory, INDEX_FILE))
+
+
+class RawResponse:
+    def __init__(self, headers: Dict[str, str], parse):
+        self.headers = headers
+        self.parse = parse
+
+
+class Completions:
+    def __init__(self, cassette: Cassette, namespace: str, client=None):
+        self.cassette = cassette
+        self.namespace = namespace
+        self.client = client
+        self.with_raw_response = RawCompletions(self)
+
+    def create(self, **request):
+        return self.create_raw(request).parse()
+
+    def create_raw(self, request: Dict[str, Any]) -> RawResponse:
+        if self.cassette.replay:
+            interaction = self.cassette.lookup(self.namespace, request)
+            return RawResponse(interaction["headers"], lambda: replay_response(interaction))
+
+        raw_response = self.client.chat.completions.with_raw_response.create(**request)
+        headers = dict(raw_response.headers)
+        response = raw_response.parse()
+        if isinstance(response, ChatCompletion):
+            self.cassette.record(self.namespace, request, headers, response=response)
+            return RawResponse(headers, lambda: response)
+
+        def record_stream() -> Iterator[ChatCompletionChunk]:
+            # Streams closed early are recorded as far as they were read, so replays stop at the same point
+            chunks = []
+            try:
+                for chunk in response:
+                    chunks.append(chunk)
+                    yield chunk
+            except GeneratorExit:
+                response.close()
+                self.cassette.record(self.namespace, request, headers, chunks=chunks)
+                raise
+            self.cassette.record(self.namespace, request, headers, chunks=chunks)
+
+        stream = record_stream()
+        return RawResponse(headers, lambda: stream)
+
+
+class RawCompletions:
+    def __init__(self, completions: Completions):
+        self.completions = completions
+
+    def create(self, **request) -> RawResponse:
+        return self.completions.create_raw(request)
+
+
+class AsyncCompletions:
+    def __init__(self, cassette: Cassette, namespace: str, client=None):
+        self.cassette = cassette
+        self.namespace = namespace
+        self.client = client
+        self.with_raw_response = AsyncRawCompletions(self)
+
+    async def create(self, **request):
+        return (await self.create_raw(request)).parse()
+
+    async def create_raw(self, request: Dict[str, Any]) -> RawResponse:
+        if self.cassette.replay:
+            interaction = self.cassette.lookup(self.namespace, request)
+            return RawResponse(interaction["headers"], lambda: replay_response_async(interaction))
+
+        raw_response = await self.client.chat.completions.with_raw_response.create(**request)
+        headers = dict(raw_response.headers)
+        response = raw_response.parse()
+        if isinstance(response, ChatCompletion):
+            self.cassette.record(self.namespace, request, headers, response=response)
+            return RawResponse(headers, lambda: response)
+
+        async def record_stream() -> AsyncIterator[ChatCompletionChunk]:
+            chunks = []
+            try:
+                async for chunk in response:
+                    chunks.append(chunk)
+                    yield chunk
+            except GeneratorExit:
+                await response.close()
+                self.cassette.record(self.namespace, request, headers, chunks=chunks)
+                raise
+            self.cassette.record(self.namespace, request, headers, chunks=chunks)
+
+        stream = record_stream()
+        return RawResponse(headers, lambda: stream)
+
+
+class AsyncRawCompletions:
+    def __init__(self, completions: AsyncCompletions):
+        self.completions = completions
+
+    async def create(self, **request) -> RawResponse:
+        return await self.completions.create_raw(request)
+
+
+class Chat:
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class CassetteClient:
+    """
+    Stand-in for OpenAI and AsyncOpenAI clients that records the responses of a wrapped client, or replays
+    recorded responses without a client. Only the chat completion API used by the suite is supported.
+    """
+
+    def __init__(self, cassette: Cassette, namespace: str, client=None, asynchronous: bool = False):
+        completions_class = AsyncCompletions if asynchronous else Completions
+        self.client = client
+        self.chat = Chat(completions_class(cassette, namespace, client))
+
+    async def __aenter__(self):
+        if self.client is not None:
+            await self.client.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        if self.client is not None:
+            await self.client.__aexit__(*args)
+
+
+def replay_response(interaction: Dict[str, Any]) -> ChatCompletion | Iterator[ChatCompletionChunk]:
+    if "chunks" in interaction:
+        return iter([ChatCompletionChunk.model_validate(chunk) for chunk in interaction["chunks"]])
+
+    return ChatCompletion.model_validate(interaction["response"])
+
+
+def replay_response_async(interaction: Dict[str, Any]) -> ChatCompletion | AsyncIterator[ChatCompletionChunk]:
+    if "chunks" not in interaction:
+        return ChatCompletion.model_validate(interaction["response"])
+
+    async def stream() -> AsyncIterator[ChatCompletionChunk]:
+        for chunk in interaction["chunks"]:
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    return stream()
@@ -0,0 +1,940 @@
+import asyncio
+import inspect
+import itertools
+import json
+import time
+from typing import Any, Callable, Dict, Generator, Iterable, Optional, Tuple
+from openai import OpenAI, AsyncOpenAI, AsyncStream, RateLimitError
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from collections import deque
+from .assembler import ChatCompletionAssembler
+from .function_calling_test_suite import TestCase, Actual, ActualFunctionCall, TurnMetrics
+from .judge_cache import JudgeCache
+from .matching import ExpectedCalls, ParsedToolCall
+from .rate_limit import RateLimiter, estimate_tokens
+from .retry import InfrastructureError, RetryPolicy, TruncatedStream, is_transient
+from . import tracing
+
+# Conversations are written as generators that yield (target, request, metrics, stream_check) tuples and receive
+# the resulting ChatCompletion. This keeps the turn-by-turn matching logic independent of how requests are executed,
+# so the same conversation can be driven synchronously or concurrently on an event loop. Drivers fill in the turn's
+# metrics, which the conversation has already added to its Actual. A stream_check, when given, is called with the
+# partially assembled response after each streamed chunk and raises AssertionError as soon as the response can no
+# longer pass; drivers then close the stream and throw the error back in.
+MODEL = "model"
+JUDGE = "judge"
+
+StreamCheck = Callable[[ChatCompletionAssembler], None]
+Turn = Tuple[str, Dict[str, Any], TurnMetrics, Optional[StreamCheck]]
+Conversation = Generator[Turn, ChatCompletion, None]
+
+DEFAULT_SYSTEM_PROMPT = """
+Make the necessary tool calls to execute the available functions in the order specified by the given prompt as correctly and efficiently as possible.
+You never explain yourself or provide additional commentary.
+You never respond with content.
+""".replace("\n", "")
+
+JUDGE_MODEL = 'gpt-4-turbo-preview'
+
+JUDGE_SYSTEM_PROMPT = """When given JSON objects that conform to the following JSONSchema:
+{
+    "name": "judge",
+    "type": "object",
+    "properties": {
+        "final_answer": {
+            "type": "string",
+            "description": "An answer to judge for correctness."
+        },
+        "final_answer_should": {
+            "type": "string",
+            "description": "The constraints that final_answer must completely satisfy to be considered correct."
+        }
+    },
+    "required": [
+        "final_answer",
+        "final_answer_should"
+    ]
+}
+
+Determine if `final_answer` satisfies the constraints described by `final_answer_should`.
+`final_answer` is considered correct if and only if it satisfies the constraints described by `final_answer_should`.
+
+After making a determination, respond with a JSON object that conforms to the following JSONSchema:
+
+{
+    "name": "ruling",
+    "type": "object",
+    "properties": {
+        "correct": {
+            "type": "boolean",
+            "description": "Set to true if and only if the answer is considered correct."
+        },
+        "reasoning": {
+            "type": "string",
+            "description": "A brief summary of the reasoning used to come to the determination."
+        }
+    },
+    "required": [
+        "correct",
+        "reasoning"
+    ]
+}
+
+Your responses are concise and include only the json object described above.
+"""
+
+JUDGE_BATCH_SYSTEM_PROMPT = """When given a JSON object with an `answers` array of objects that conform to the following JSONSchema:
+{
+    "name": "judge",
+    "type": "object",
+    "properties": {
+        "final_answer": {
+            "type": "string",
+            "description": "An answer to judge for correctness."
+        },
+        "final_answer_should": {
+            "type": "string",
+            "description": "The constraints that final_answer must completely satisfy to be considered correct."
+        }
+    },
+    "required": [
+        "final_answer",
+        "final_answer_should"
+    ]
+}
+
+Determine, independently for each object, if `final_answer` satisfies the constraints described by `final_answer_should`.
+`final_answer` is considered correct if and only if it satisfies the constraints described by `final_answer_should`.
+
+After making a determination for every object, respond with a JSON object with a `rulings` array containing one ruling
+per object in `answers`, in the same order, where each ruling conforms to the following JSONSchema:
+
+{
+    "name": "ruling",
+    "type": "object",
+    "properties": {
+        "correct": {
+            "type": "boolean",
+            "description": "Set to true if and only if the answer is considered correct."
+        },
+        "reasoning": {
+            "type": "string",
+            "description": "A brief summary of the reasoning used to come to the determination."
+        }
+    },
+    "required": [
+        "correct",
+        "reasoning"
+    ]
+}
+
+Your responses are concise and include only the json object described above.
+"""
+
+
+class ConversationSkipped(Exception):
+    pass
+
+
+def converse(
+        test_case: TestCase,
+        model: str | None,
+        stream: bool,
+        use_system_prompt: bool,
+        judge_cache: Optional[JudgeCache] = None,
+        fail_fast: bool = False,
+        stream_usage: bool = False,
+) -> Conversation:
+    tools = []
+    for function in test_case.available_functions:
+        tools.append({
+            "type": "function",
+            "function": function,
+        })
+
+    messages = []
+    if test_case.system_prompt:
+        messages.append({
+            "role": "system",
+            "content": test_case.system_prompt,
+        })
+    elif use_system_prompt:
+        messages.append({
+            "role": "system",
+            "content": DEFAULT_SYSTEM_PROMPT,
+        })
+
+    messages.append({
+        "role": "user",
+        "content": test_case.prompt,
+    })
+
+    # Runs don't keep their own copy of the tools, which are the spec's functions and are added back to reports
+    test_case.actual = Actual(messages=messages)
+
+    call_index = 0
+    answers = []
+
+    # Consumed as calls are matched, without modifying the spec
+    expected_calls = ExpectedCalls(test_case.expected_function_calls or [])
+    while True:
+        stream_check = None
+        if stream and fail_fast:
+            stream_check = ToolCallStreamCheck(test_case, expected_calls, call_index)
+
+        request = dict(
+            messages=messages,
+            model=model,
+            tools=tools,
+            tool_choice="auto",
+            temperature=0,
+            stream=stream,
+            n=1,
+        )
+        if stream and stream_usage:
+            request["stream_options"] = {"include_usage": True}
+
+        metrics = TurnMetrics(target=MODEL)
+        test_case.actual.turns.append(metrics)
+        model_response = yield MODEL, request, metrics, stream_check
+        test_case.actual.responses.append(model_response.model_dump(mode='json', exclude_unset=True, exclude_none=True))
+
+        choices = model_response.choices
+        assert choices is not None and len(choices) == 1, f"Call {call_index}: Model returned unexpected number of choices"
+
+        choice = choices[0]
+        message = choice.message
+        assert message.role == "assistant", f"Call {call_index}: Model returned unexpected role: {message.role}"
+
+        messages.append(message.model_dump(mode='json', exclude_unset=True, exclude_none=True))
+        if message.content:
+            answers.append(message.content)
+
+        # Arguments are parsed once, and the parsed calls are used for matching
+        tool_calls = deque(ParsedToolCall.parse(tool_call) for tool_call in message.tool_calls or [])
+        for tool_call in tool_calls:
+            test_case.actual.function_calls.append(ActualFunctionCall(
+                name=tool_call.name,
+                arguments=tool_call.arguments
+            ))
+
+        assert len(tool_calls) <= expected_calls.remaining, f"Call {call_index}: Model returned more tool calls than expected"
+
+        if len(expected_calls) == 0 or len(tool_calls) == 0:
+            assert choice.finish_reason == "stop", f"Call {call_index}: Model returned unexpected finish reason"
+            break
+
+        while tool_calls and expected_calls:
+            tool_call = tool_calls.popleft()
+            expected_call, call_index = expected_calls.match(tool_call, call_index)
+
+            messages.append({
+                "tool_call_id": tool_call.id,
+                "role": "tool",
+                "name": expected_call.name,
+                "content": expected_call.result
+            })
+            test_case.actual.messages = messages
+            call_index += 1
+
+        assert len(tool_calls) == 0, f"Call {call_index}: Model returned unexpected tool calls"
+
+    assert expected_calls.required == 0, f"Model did not make all required tool calls before stopping"
+
+    if test_case.final_answer_should:
+        final_answer = '\n'.join(answers)
+        correct, reasoning = yield from judge_final_answer(
+            stream,
+            final_answer,
+            test_case.final_answer_should,
+            judge_cache,
+            test_case.actual.turns,
+            stream_usage,
+        )
+        test_case.actual.answers = answers
+        test_case.actual.judge_ruling = reasoning
+
+        assert correct, f"Model's final answer ruled incorrect by judge: \"{reasoning}\""
+
+
+class ToolCallStreamCheck:
+    """
+    Checks the tool calls of a streamed model response against the expected calls while it is still arriving.
+
+    A response is closed as soon as it has more tool calls than there are expected calls left, which is the first
+    check converse makes on a response's tool calls. A call with an unexpected name or arguments isn't failed early:
+    calls still to come could exceed the expected calls, which converse would report instead, so the same response
+    fails with the same message with or without the stream check.
+    """
+
+    def __init__(self, test_case: TestCase, expected_calls: ExpectedCalls, call_index: int):
+        self.test_case = test_case
+        self.call_index = call_index
+        self.remaining_expected_calls = expected_calls.remaining
+
+    def __call__(self, assembler: ChatCompletionAssembler):
+        # converse checks the number of choices and the role before the tool calls
+        choice = assembler.choice()
+        if len(assembler.choices) != 1 or choice is None or choice.role != "assistant" or not choice.tool_calls:
+            return
+
+        tool_calls = assembler.tool_calls()
+        try:
+            assert len(tool_calls) <= self.remaining_expected_calls, f"Call {self.call_index}: Model returned more tool calls than expected"
+        except AssertionError:
+            self.record(assembler)
+            raise
+
+    def record(self, assembler: ChatCompletionAssembler):
+        partial_response = assembler.snapshot()
+        actual = self.test_case.actual
+        actual.responses.append(partial_response)
+        if partial_response["choices"]:
+            actual.messages.append(partial_response["choices"][0]["message"])
+
+        for tool_call in assembler.tool_calls():
+            try:
+                arguments = json.loads(tool_call.arguments)
+            except ValueError:
+                continue
+            actual.function_calls.append(ActualFunctionCall(name=tool_call.name, arguments=arguments))
+
+
+def judge_final_answer(
+        stream: bool,
+        final_answer: str,
+        final_answer_should: str,
+        judge_cache: Optional[JudgeCache] = None,
+        turns: Optional[list[TurnMetrics]] = None,
+        stream_usage: bool = False,
+) -> Generator[Turn, ChatCompletion, Tuple[bool, str]]:
+    if not final_answer_should:
+        return None, True
+
+    # The spans leave out the judge request, which is traced where it's sent, and any wait for deferred judging
+    cache_key = None
+    if judge_cache is not None:
+        with tracing.span("judge_final_answer", phase="cache_lookup"):
+            cache_key = judge_cache.key(JUDGE_MODEL, JUDGE_SYSTEM_PROMPT, final_answer, final_answer_should)
+            cached_ruling = judge_cache.get(cache_key)
+        if cached_ruling is not None:
+            return cached_ruling
+
+    request = dict(
+        model=JUDGE_MODEL,
+        response_format={
+            "type": "json_object",
+        },
+        messages=[{
+            "role": "system",
+            "content": JUDGE_SYSTEM_PROMPT,
+        }, {
+            "role": "user",
+            "content": json.dumps({
+                "final_answer": final_answer,
+                "final_answer_should": final_answer_should,
+            })
+        }],
+        stream=stream
+    )
+    if stream and stream_usage:
+        request["stream_options"] = {"include_usage": True}
+
+    metrics = TurnMetrics(target=JUDGE)
+    if turns is not None:
+        turns.append(metrics)
+    judge_completion = yield JUDGE, request, metrics, None
+
+    with tracing.span("judge_final_answer", phase="ruling", batch_size=metrics.batch_size):
+        judge_message = judge_completion.choices[0].message.content
+        judge_ruling = json.loads(judge_message)
+
+        try:
+            correct, reasoning = judge_ruling['correct'], judge_ruling['reasoning']
+        except KeyError as e:
+            raise ValueError(f"Failed to judge final answer. Judge response missing key: {e}")
+
+        # Rulings split out of a batched request were made with JUDGE_BATCH_SYSTEM_PROMPT, not the prompt of the key
+        if cache_key is not None and metrics.batch_size == 1:
+            judge_cache.put(cache_key, correct, reasoning)
+
+    return correct, reasoning
+
+
+def run_conversation(
+        conversation: Conversation,
+        model_client: OpenAI,
+        judge_client: OpenAI,
+        model_rate_limiter: Optional[RateLimiter] = None,
+        judge_rate_limiter: Optional[RateLimiter] = None,
+        model_retry_policy: Optional[RetryPolicy] = None,
+        judge_retry_policy: Optional[RetryPolicy] = None,
+):
+    clients = {
+        MODEL: (model_client, model_rate_limiter, model_retry_policy),
+        JUDGE: (judge_client, judge_rate_limiter, judge_retry_policy),
+    }
+    response = None
+    while True:
+        try:
+            target, request, metrics, stream_check = conversation.send(response)
+        except StopIteration:
+            return
+
+        client, rate_limiter, retry_policy = clients[target]
+        try:
+            response = create_chat_completion(client, rate_limiter, request, stream_check, metrics, retry_policy)
+        except AssertionError as e:
+            conversation.throw(e)
+
+
+async def run_conversation_async(
+        conversation: Conversation,
+        model_client: AsyncOpenAI,
+        judge_client: AsyncOpenAI,
+        model_rate_limiter: Optional[RateLimiter] = None,
+        judge_rate_limiter: Optional[RateLimiter] = None,
+        defer_judging: bool = False,
+        response: Optional[ChatCompletion] = None,
+        model_retry_policy: Optional[RetryPolicy] = None,
+        judge_retry_policy: Optional[RetryPolicy] = None,
+) -> Optional[Tuple[Dict[str, Any], TurnMetrics]]:
+    # With defer_judging, the conversation is left suspended at its judge request and the request is returned
+    # with its metrics, so it can be resumed later by sending it the judge's completion.
+    clients = {
+        MODEL: (model_client, model_rate_limiter, model_retry_policy),
+        JUDGE: (judge_client, judge_rate_limiter, judge_retry_policy),
+    }
+    while True:
+        try:
+            target, request, metrics, stream_check = conversation.send(response)
+        except StopIteration:
+            return None
+
+        if target == JUDGE and defer_judging:
+            return request, metrics
+
+        client, rate_limiter, retry_policy = clients[target]
+        try:
+            response = await create_chat_completion_async(
+                client, rate_limiter, request, stream_check, metrics, retry_policy
+            )
+        except AssertionError as e:
+            conversation.throw(e)
+
+
+async def run_conversations_async(
+        conversations: Iterable[Conversation],
+        model_client: AsyncOpenAI,
+        judge_client: AsyncOpenAI,
+        concurrency: int,
+        model_rate_limiter: Optional[RateLimiter] = None,
+        judge_rate_limiter: Optional[RateLimiter] = None,
+        defer_judging: bool = False,
+        judge_batch_size: int = 1,
+        should_run: Optional[Callable[[int], bool]] = None,
+        on_done: Optional[Callable[[int, BaseException | None], None]] = None,
+        model_retry_policy: Optional[RetryPolicy] = None,
+        judge_retry_policy: Optional[RetryPolicy] = None,
+) -> list[BaseException | None]:
+    # should_run is asked right before a conversation starts, and conversations it declines end with
+    # ConversationSkipped. on_done is called with the outcome of every conversation that ran.
+    conversations = list(conversations)
+    semaphore = asyncio.Semaphore(concurrency)
+    judge_requests = {}
+    # The span attributes of each suspended conversation, for its deferred judge request
+    judge_attributes = {}
+
+    def done(index: int, error: BaseException | None) -> BaseException | None:
+        if on_done is not None:
+            on_done(index, error)
+        release_frames(error)
+        return error
+
+    async def run(index: int, conversation: Conversation) -> BaseException | None:
+        async with semaphore:
+            if should_run is not None and not should_run(index):
+                conversation.close()
+                return ConversationSkipped()
+
+            try:
+                judge_request = await run_conversation_async(
+                    conversation,
+                    model_client,
+                    judge_client,
+                    model_rate_limiter,
+                    judge_rate_limiter,
+                    defer_judging,
+                    model_retry_policy=model_retry_policy,
+                    judge_retry_policy=judge_retry_policy,
+                )
+            except Exception as e:
+                return done(index, e)
+
+            if judge_request is not None:
+                judge_requests[index] = judge_request
+                judge_attributes[index] = tracing.ATTRIBUTES.get()
+                return None
+            return done(index, None)
+
+    errors = await asyncio.gather(*(run(index, conversation) for index, conversation in enumerate(conversations)))
+    if not judge_requests:
+        return errors
+
+    # Judging stage: evaluate every queued ruling, then resume the suspended conversations with their verdicts
+    indexes = list(judge_requests.keys())
+    judge_completions = await judge_deferred(
+        [judge_requests[index] for index in indexes],
+        judge_client,
+        concurrency,
+        judge_rate_limiter,
+        judge_batch_size,
+        judge_retry_policy,
+        [judge_attributes[index] for index in indexes],
+    )
+
+    for index, judge_completion in zip(indexes, judge_completions):
+        if isinstance(judge_completion, BaseException):
+            errors[index] = done(index, judge_completion)
+            continue
+
+        try:
+            await run_conversation_async(
+                conversations[index],
+                model_client,
+                judge_client,
+                model_rate_limiter,
+                judge_rate_limiter,
+                response=judge_completion,
+                model_retry_policy=model_retry_policy,
+                judge_retry_policy=judge_retry_policy,
+            )
+            done(index, None)
+        except Exception as e:
+            errors[index] = done(index, e)
+
+    return errors
+
+
+def release_frames(error: BaseException | None):
+    # Errors are kept until their runs are reported, but not the locals of the finished conversations in their
+    # tracebacks, such as the run's test case. Rewritten asserts also leave a copy of the locals in f_locals.
+    while error is not None:
+        tb = error.__traceback__
+        while tb is not None:
+            try:
+                tb.tb_frame.clear()
+                tb.tb_frame.f_locals.clear()
+            except RuntimeError:
+                pass  # The frames still executing, such as the caller's
+            tb = tb.tb_next
+        error = error.__cause__ or error.__context__
+
+
+async def judge_deferred(
+        judge_requests: list[Tuple[Dict[str, Any], TurnMetrics]],
+        judge_client: AsyncOpenAI,
+        concurrency: int,
+        judge_rate_limiter: Optional[RateLimiter] = None,
+        judge_batch_size: int = 1,
+        judge_retry_policy: Optional[RetryPolicy] = None,
+        judge_attributes: Optional[list[Dict[str, Any]]] = None,
+) -> list[ChatCompletion | BaseException]:
+    # judge_attributes are the span attributes of each request's conversation. Batched requests judge several
+    # conversations at once, so their spans only carry the batch size.
+    semaphore = asyncio.Semaphore(concurrency)
+    tracing.ATTRIBUTES.set({})
+    attributes = {
+        id(metrics): values for (_, metrics), values in zip(judge_requests, judge_attributes or [])
+    }
+
+    async def judge(request: Dict[str, Any], metrics: TurnMetrics) -> ChatCompletion | BaseException:
+        try:
+            with tracing.attributes(**attributes.get(id(metrics), {})):
+                return await create_chat_completion_async(
+                    judge_client, judge_rate_limiter, request, metrics=metrics, retry_policy=judge_retry_policy
+                )
+        except Exception as e:
+            return e
+
+    async def judge_batch(batch: list[Tuple[Dict[str, Any], TurnMetrics]]) -> list[ChatCompletion | BaseException]:
+        async with semaphore:
+            if len(batch) == 1:
+                return [await judge(*batch[0])]
+
+            batch_metrics = TurnMetrics(target=JUDGE, batch_size=len(batch))
+            try:
+                batch_completion = await create_chat_completion_async(
+                    judge_client,
+                    judge_rate_limiter,
+                    batch_judge_request([request for request, _ in batch]),
+                    metrics=batch_metrics,
+                    retry_policy=judge_retry_policy,
+                )
+                completions = split_batch_judge_completion(batch_completion, len(batch))
+            except Exception:
+                # Fall back to judging each answer on its own when the batched ruling is unusable
+                return [await judge(request, metrics) for request, metrics in batch]
+
+            for _, metrics in batch:
+                for field in TurnMetrics.model_fields:
+                    setattr(metrics, field, getattr(batch_metrics, field))
+            return completions
+
+    batches = [judge_requests[i:i + max(1, judge_batch_size)] for i in range(0, len(judge_requests), max(1, judge_batch_size))]
+    results = await asyncio.gather(*(judge_batch(batch) for batch in batches))
+    return [completion for batch_results in results for completion in batch_results]
+
+
+def batch_judge_request(judge_requests: list[Dict[str, Any]]) -> Dict[str, Any]:
+    request = dict(
+        model=JUDGE_MODEL,
+        response_format={
+            "type": "json_object",
+        },
+        messages=[{
+            "role": "system",
+            "content": JUDGE_BATCH_SYSTEM_PROMPT,
+        }, {
+            "role": "user",
+            "content": json.dumps({
+                "answers": [json.loads(request["messages"][-1]["content"]) for request in judge_requests],
+            })
+        }],
+        stream=judge_requests[0]["stream"]
+    )
+    if "stream_options" in judge_requests[0]:
+        request["stream_options"] = judge_requests[0]["stream_options"]
+
+    return request
+
+
+def split_batch_judge_completion(batch_completion: ChatCompletion, count: int) -> list[ChatCompletion]:
+    rulings = json.loads(batch_completion.choices[0].message.content)["rulings"]
+    if not isinstance(rulings, list) or len(rulings) != count:
+        raise ValueError(f"Batched judge returned {len(rulings)} rulings for {count} answers")
+
+    return [
+        ChatCompletion(
+            id=batch_completion.id,
+            created=batch_completion.created,
+            object="chat.completion",
+            model=batch_completion.model,
+            choices=[{
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": json.dumps(ruling),
+                },
+                "finish_reason": "stop",
+            }],
+            system_fingerprint=batch_completion.system_fingerprint,
+        )
+        for ruling in rulings
+    ]
+
+
+def create_chat_completion(
+        client: OpenAI,
+        rate_limiter: Optional[RateLimiter],
+        request: Dict[str, Any],
+        stream_check: Optional[StreamCheck] = None,
+        metrics: Optional[TurnMetrics] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+) -> ChatCompletion:
+    with tracing.span("chat_completion", **completion_attributes(request, metrics)):
+        tokens = estimate_tokens(request)
+        retries = {"rate_limited": 0, "failed": 0}
+        for attempt in itertools.count():
+            if rate_limiter is not None:
+                rate_limiter.wait(tokens)
+            start = start_turn(metrics, attempt)
+            try:
+                raw_response = client.chat.completions.with_raw_response.create(**request)
+                completion = to_chat_completion(raw_response.parse(), stream_check, metrics, start)
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                time.sleep(retry_delay(e, retries, rate_limiter, retry_policy))
+                continue
+
+            observe_completion(rate_limiter, retry_policy, raw_response.headers, tokens, completion, start)
+            return completion
+
+
+async def create_chat_completion_async(
+        client: AsyncOpenAI,
+        rate_limiter: Optional[RateLimiter],
+        request: Dict[str, Any],
+        stream_check: Optional[StreamCheck] = None,
+        metrics: Optional[TurnMetrics] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+) -> ChatCompletion:
+    with tracing.span("chat_completion", **completion_attributes(request, metrics)):
+        tokens = estimate_tokens(request)
+        retries = {"rate_limited": 0, "failed": 0}
+        for attempt in itertools.count():
+            # Streams checked while they arrive aren't hedged, since both copies would record into the same test case
+            hedge_delay = retry_policy.hedge_delay() if retry_policy is not None and stream_check is None else None
+            try:
+                if hedge_delay is None:
+                    return await send_chat_completion_async(
+                        client, rate_limiter, request, tokens, stream_check, metrics, retry_policy, attempt
+                    )
+                return await hedge_chat_completion_async(
+                    client, rate_limiter, request, tokens, metrics, retry_policy, attempt, hedge_delay
+                )
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                await asyncio.sleep(retry_delay(e, retries, rate_limiter, retry_policy))
+
+
+async def send_chat_completion_async(
+        client: AsyncOpenAI,
+        rate_limiter: Optional[RateLimiter],
+        request: Dict[str, Any],
+        tokens: int,
+        stream_check: Optional[StreamCheck],
+        metrics: Optional[TurnMetrics],
+        retry_policy: Optional[RetryPolicy],
+        attempt: int,
+) -> ChatCompletion:
+    if rate_limiter is not None:
+        await rate_limiter.wait_async(tokens)
+    start = start_turn(metrics, attempt)
+    raw_response = await client.chat.completions.with_raw_response.create(**request)
+    completion = await to_chat_completion_async(raw_response.parse(), stream_check, metrics, start)
+    observe_completion(rate_limiter, retry_policy, raw_response.headers, tokens, completion, start)
+    return completion
+
+
+async def hedge_chat_completion_async(
+        client: AsyncOpenAI,
+        rate_limiter: Optional[RateLimiter],
+        request: Dict[str, Any],
+        tokens: int,
+        metrics: Optional[TurnMetrics],
+        retry_policy: RetryPolicy,
+        attempt: int,
+        hedge_delay: float,
+) -> ChatCompletion:
+    # Sends a duplicate of a request that is slower than hedge_delay and returns whichever response completes
+    # first. The other request is cancelled, and the duplicate's metrics replace the original's when it wins.
+    def send(send_metrics: Optional[TurnMetrics]) -> asyncio.Task:
+        return asyncio.ensure_future(send_chat_completion_async(
+            client, rate_limiter, request, tokens, None, send_metrics, retry_policy, attempt
+        ))
+
+    primary = send(metrics)
+    done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+    if done:
+        return primary.result()
+
+    hedge_metrics = TurnMetrics(target=metrics.target) if metrics is not None else None
+    hedge = send(hedge_metrics)
+    with retry_policy.lock:
+        retry_policy.hedges += 1
+
+    pending = {primary, hedge}
+    winner = None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((task for task in done if task.exception() is None), None)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    if winner is None:
+        # Both failed, retry with the original request's error
+        raise primary.exception()
+
+    if winner is hedge:
+        with retry_policy.lock:
+            retry_policy.hedge_wins += 1
+        if metrics is not None:
+            for field in TurnMetrics.model_fields:
+                setattr(metrics, field, getattr(hedge_metrics, field))
+
+    return winner.result()
+
+
+def retry_delay(
+        error: Exception,
+        retries: Dict[str, int],
+        rate_limiter: Optional[RateLimiter],
+        retry_policy: Optional[RetryPolicy],
+) -> float:
+    # Returns how long to wait before retrying after a transient error, or raises InfrastructureError once the
+    # retries for it are used up. Rate limits are retried after the rate limiter's pause, other errors with backoff.
+    if isinstance(error, RateLimitError) and rate_limiter is not None:
+        if retries["rate_limited"] >= rate_limiter.max_retries:
+            raise InfrastructureError(f"Rate limited after {retries['rate_limited'] + 1} attempts: {error}") from error
+        retries["rate_limited"] += 1
+        rate_limiter.throttle(error.response.headers)
+        return 0.0
+
+    if retry_policy is None or retries["failed"] >= retry_policy.max_retries:
+        raise InfrastructureError(f"{type(error).__name__} after {retries['failed'] + 1} attempts: {error}") from error
+    delay = retry_policy.backoff(retries["failed"])
+    retries["failed"] += 1
+    return delay
+
+
+def observe_completion(
+        rate_limiter: Optional[RateLimiter],
+        retry_policy: Optional[RetryPolicy],
+        headers,
+        tokens: int,
+        completion: ChatCompletion,
+        start: float,
+):
+    if rate_limiter is not None:
+        rate_limiter.observe(headers, tokens, used_tokens(completion))
+    if retry_policy is not None:
+        retry_policy.observe(time.monotonic() - start)
+
+
+def used_tokens(completion: ChatCompletion) -> Optional[int]:
+    if completion.usage is not None:
+        return completion.usage.total_tokens
+
+    return None
+
+
+def completion_attributes(request: Dict[str, Any], metrics: Optional[TurnMetrics]) -> Dict[str, Any]:
+    attributes = {"request_model": request.get("model"), "stream": bool(request.get("stream"))}
+    if metrics is not None:
+        attributes["target"] = metrics.target
+        if metrics.batch_size > 1:
+            attributes["batch_size"] = metrics.batch_size
+    return attributes
+
+
+def start_turn(metrics: Optional[TurnMetrics], attempt: int = 0) -> float:
+    # Timings are measured from when the final attempt was sent; earlier attempts only count as retries
+    if metrics is not None:
+        metrics.started = time.time()
+        metrics.retries = attempt
+        metrics.time_to_first_chunk = None
+        metrics.time_to_first_tool_call = None
+        metrics.latency = None
+
+    return time.monotonic()
+
+
+def observe_chunk(metrics: TurnMetrics, assembler: ChatCompletionAssembler, start: float):
+    if metrics.time_to_first_chunk is None:
+        metrics.time_to_first_chunk = time.monotonic() - start
+
+    if metrics.time_to_first_tool_call is None:
+        choice = assembler.choice()
+        if choice is not None and choice.tool_calls:
+            metrics.time_to_first_tool_call = time.monotonic() - start
+
+
+def finish_turn(metrics: Optional[TurnMetrics], start: float, usage, tool_calls: bool = False):
+    if metrics is None:
+        return
+
+    metrics.latency = time.monotonic() - start
+    # Non-streamed responses arrive all at once
+    if metrics.time_to_first_chunk is None:
+        metrics.time_to_first_chunk = metrics.latency
+    if tool_calls and metrics.time_to_first_tool_call is None:
+        metrics.time_to_first_tool_call = metrics.latency
+
+    if usage is not None:
+        metrics.prompt_tokens = usage.prompt_tokens
+        metrics.completion_tokens = usage.completion_tokens
+
+
+def has_tool_calls(completion: ChatCompletion) -> bool:
+    return any(choice.message.tool_calls for choice in completion.choices or [])
+
+
+async def to_chat_completion_async(
+        response: ChatCompletion | AsyncStream[ChatCompletionChunk],
+        stream_check: Optional[StreamCheck] = None,
+        metrics: Optional[TurnMetrics] = None,
+        start: Optional[float] = None,
+) -> ChatCompletion:
+    start = start if start is not None else time.monotonic()
+    if isinstance(response, ChatCompletion):
+        finish_turn(metrics, start, response.usage, has_tool_calls(response))
+        return response
+
+    with tracing.span("to_chat_completion"):
+        assembler = ChatCompletionAssembler()
+        try:
+            async for chunk in response:
+                assembler.add(chunk)
+                if metrics is not None:
+                    observe_chunk(metrics, assembler, start)
+                if stream_check is not None:
+                    stream_check(assembler)
+        except AssertionError:
+            # Stop paying for tokens that can no longer change the outcome
+            await close_stream_async(response)
+            finish_turn(metrics, start, assembler.usage)
+            raise
+        except asyncio.CancelledError:
+            # The other copy of a hedged request won
+            await close_stream_async(response)
+            raise
+
+        finish_turn(metrics, start, assembler.usage)
+        return finalize_stream(assembler)
+
+
+def to_chat_completion(
+        response: ChatCompletion | Iterable[ChatCompletionChunk],
+        stream_check: Optional[StreamCheck] = None,
+        metrics: Optional[TurnMetrics] = None,
+        start: Optional[float] = None,
+) -> ChatCompletion:
+    start = start if start is not None else time.monotonic()
+    if isinstance(response, ChatCompletion):
+        finish_turn(metrics, start, response.usage, has_tool_calls(response))
+        return response
+
+    with tracing.span("to_chat_completion"):
+        assembler = ChatCompletionAssembler()
+        try:
+            for chunk in response:
+                assembler.add(chunk)
+                if metrics is not None:
+                    observe_chunk(metrics, assembler, start)
+                if stream_check is not None:
+                    stream_check(assembler)
+        except AssertionError:
+            close_stream(response)
+            finish_turn(metrics, start, assembler.usage)
+            raise
+
+        finish_turn(metrics, start, assembler.usage)
+        return finalize_stream(assembler)
+
+
+def finalize_stream(assembler: ChatCompletionAssembler) -> ChatCompletion:
+    if not assembler.choices:
+        raise TruncatedStream("Stream ended without any choices")
+
+    return assembler.finalize()
+
+
+def close_stream(response):
+    close = getattr(response, "close", None)
+    if close is not None:
+        close()
+
+
+async def close_stream_async(response):
+    # AsyncStream closes with an awaitable close(), async generators (e.g. replayed cassettes) with aclose()
+    close = getattr(response, "aclose", None) or getattr(response, "close", None)
+    if close is not None:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
@@ -24,6 +24,18 @@ class ActualFunctionCall(BaseModel):
     arguments: Optional[Dict[str, Any]] = None
 
 
+class TurnMetrics(BaseModel):
+    target: str
+    started: Optional[float] = None  # Unix time the request was sent
+    time_to_first_chunk: Optional[float] = None  # Seconds from started, the whole response when not streaming
+    time_to_first_tool_call: Optional[float] = None
+    latency: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    retries: int = 0
+    batch_size: int = 1  # Number of judge rulings sharing the request
+
+
 class Actual(BaseModel):
     tools: Optional[List[Dict[str, Any]]] = []
     messages: Optional[List[Dict[str, Any]]] = []
@@ -31,6 +43,7 @@ class Actual(BaseModel):
     responses: Optional[List[Dict[str, Any]]] = []
     answers: Optional[List[str]] = []
     judge_ruling: Optional[str] = None
+    turns: Optional[List[TurnMetrics]] = []
 
 
 class TestCase(BaseModel):
@@ -55,6 +68,10 @@ class TestCase(BaseModel):
 
         return categories
 
+    def new_run(self) -> "TestCase":
+        # Runs share the parsed spec and only get their own Actual, so the spec must not be mutated during a run
+        return self.model_copy(update={"actual": Actual()})
+
     @classmethod
     def parse_yaml(cls, obj: Dict[str, Any]):
         # Preprocess expected_function_calls to handle mixed content
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Without file locks, sessions have to be given different journals
+    fcntl = None
+
+JournalKey = Tuple[str, str]
+
+
+class JournalMismatch(ValueError):
+    pass
+
+
+class JournalLocked(RuntimeError):
+    pass
+
+
+class Journal:
+    """
+    Append-only JSONL journal of the spec runs completed in a session, so an interrupted session can be resumed.
+
+    The first line records the options that change what a run does, and every following line holds one run's result
+    and its JSON report entry, keyed by node ID and model. Each line is flushed to disk as soon as the run is
+    reported. Lines that aren't valid JSON, e.g. one cut off by a crash, are skipped when the journal is loaded.
+
+    The session writing a journal holds an exclusive lock on it, so another session can't start over or continue the
+    same journal at the same time.
+    """
+
+    def __init__(self, path: str, options: Dict[str, Any], resume: bool = False, writable: bool = True):
+        # pytest-xdist workers only read the journal to find completed runs, the controller writes it
+        if writable and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[JournalKey, Dict[str, Any]] = {}
+        self.skipped = 0
+        self.file = None
+
+        if writable:
+            # Opened without truncating, which only happens once the lock is held
+            self.file = open(path, "a+")
+            self.lock_file()
+
+        if resume and os.path.exists(path):
+            try:
+                complete = self.load(options)
+            except BaseException:
+                self.close()
+                raise
+            if writable:
+                self.file.truncate(complete)
+                if not complete:
+                    self.write({"options": options})
+        elif writable:
+            self.file.truncate(0)
+            self.write({"options": options})
+
+    def lock_file(self):
+        if fcntl is None:
+            return
+
+        try:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            self.file = None
+            raise JournalLocked(f"{self.path} is in use by another session")
+
+    def load(self, options: Dict[str, Any]) -> int:
+        # Returns the length of the complete lines, after which the journal is continued
+        complete = 0
+        with open(self.path, "r") as file:
+            for number, line in enumerate(file):
+                if not line.endswith("\n"):
+                    break
+                complete += len(line.encode("utf-8"))
+
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None
+                if number == 0:
+                    written_options = entry.get("options") if isinstance(entry, dict) else None
+                    if written_options != options:
+                        raise JournalMismatch(
+                            f"{self.path} was written with {written_options}, which doesn't match {options}"
+                        )
+                    continue
+
+                if not isinstance(entry, dict) or "nodeid" not in entry or "model" not in entry:
+                    self.skipped += 1
+                    continue
+                self.entries[(entry["nodeid"], entry["model"])] = entry
+
+        return complete
+
+    def get(self, nodeid: str, model: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get((nodeid, model))
+
+    def append(self, nodeid: str, model: str, run_result: Dict[str, Any], test: Optional[Dict[str, Any]]):
+        # Only the entries loaded for --resume are kept in memory
+        with self.lock:
+            self.write({"nodeid": nodeid, "model": model, "run_result": run_result, "test": test})
+
+    def write(self, entry: Dict[str, Any]):
+        # Spec categories are sets
+        self.file.write(json.dumps(entry, default=list) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
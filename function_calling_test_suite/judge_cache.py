@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class JudgeCache:
+    """
+    On-disk LRU cache of judge rulings, keyed by a hash of everything that determines a ruling: the judge model,
+    the judge system prompt, the final answer and the final_answer_should constraints.
+
+    Hits only note when an entry was used, and the notes are written with the next put or on close, so reading a
+    cache that's shared by concurrent sessions doesn't wait for SQLite write locks.
+    """
+
+    # Hits noted before they're written anyway, bounding the memory of a read-only session
+    MAX_PENDING_USES = 1000
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.pending_uses: Dict[str, float] = {}
+        self.connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS rulings (
+                key TEXT PRIMARY KEY,
+                correct INTEGER NOT NULL,
+                reasoning TEXT NOT NULL,
+                used REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS rulings_used ON rulings (used)")
+        self.connection.commit()
+
+    @staticmethod
+    def key(model: str, system_prompt: str, final_answer: str, final_answer_should: str) -> str:
+        content = json.dumps([model, system_prompt, final_answer, final_answer_should])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[bool, str]]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT correct, reasoning FROM rulings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.pending_uses[key] = time.time()
+            if len(self.pending_uses) >= self.MAX_PENDING_USES:
+                self.write_uses()
+                self.connection.commit()
+            return bool(row[0]), row[1]
+
+    def put(self, key: str, correct: bool, reasoning: str):
+        with self.lock:
+            # Written first, so the entries used since the last put aren't evicted as least recently used
+            self.write_uses()
+            self.pending_uses.pop(key, None)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO rulings (key, correct, reasoning, used) VALUES (?, ?, ?, ?)",
+                (key, int(bool(correct)), reasoning, time.time()),
+            )
+            self.connection.execute(
+                """
+                DELETE FROM rulings WHERE key IN (
+                    SELECT key FROM rulings ORDER BY used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self.connection.commit()
+
+    def write_uses(self):
+        if self.pending_uses:
+            self.connection.executemany(
+                "UPDATE rulings SET used = ? WHERE key = ?", [(used, key) for key, used in self.pending_uses.items()]
+            )
+            self.pending_uses.clear()
+
+    def close(self):
+        with self.lock:
+            self.write_uses()
+            self.connection.commit()
+            self.connection.close()
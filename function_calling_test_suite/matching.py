@@ -0,0 +1,125 @@
+import json
+from collections import deque
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+from .function_calling_test_suite import ExpectedFunctionCall, ExpectedFunctionCallGroup
+
+
+def call_key(name: Optional[str], arguments: Any) -> str:
+    # Values YAML parses into other types than JSON does, e.g. dates, are keyed by their repr so they never match
+    return json.dumps([name, arguments], sort_keys=True, separators=(",", ":"), default=repr)
+
+
+class ParsedToolCall(NamedTuple):
+    # A tool call with its arguments parsed, so they're only parsed once however often they're compared
+    id: Optional[str]
+    name: Optional[str]
+    arguments: Any
+
+    @classmethod
+    def parse(cls, tool_call) -> "ParsedToolCall":
+        # Raises ValueError when the arguments aren't valid JSON
+        return cls(tool_call.id, tool_call.function.name, json.loads(tool_call.function.arguments))
+
+    def key(self) -> str:
+        return call_key(self.name, self.arguments)
+
+
+class CallGroup:
+    """
+    An any_order group of expected calls, indexed by the canonical JSON of their name and arguments.
+
+    Matched calls are removed from the index and their slot emptied, so matching a call takes constant time.
+    Arguments that are equal without having the same JSON, e.g. 1 and 1.0, fall back to a scan of the slots.
+    """
+
+    def __init__(self, calls: Iterable[ExpectedFunctionCall]):
+        self.calls: List[Optional[ExpectedFunctionCall]] = list(calls)
+        self.index: Dict[str, deque] = {}
+        for position, call in enumerate(self.calls):
+            self.index.setdefault(call_key(call.name, call.arguments), deque()).append(position)
+        self.remaining = len(self.calls)
+        self.required = sum(not call.optional for call in self.calls)
+
+    def pop(self, tool_call: ParsedToolCall) -> Optional[ExpectedFunctionCall]:
+        # Like the first call in the group that matches, as the slots of each key are in group order
+        positions = self.index.get(tool_call.key())
+        if positions:
+            position = positions.popleft()
+        else:
+            position = next((
+                position for position, call in enumerate(self.calls)
+                if call is not None and call.name == tool_call.name and call.arguments == tool_call.arguments
+            ), None)
+            if position is None:
+                return None
+            self.index[call_key(self.calls[position].name, self.calls[position].arguments)].remove(position)
+
+        call = self.calls[position]
+        self.calls[position] = None
+        self.remaining -= 1
+        self.required -= not call.optional
+        return call
+
+
+Step = Union[ExpectedFunctionCall, CallGroup]
+
+
+class ExpectedCalls:
+    """
+    The expected calls of a run, consumed as the model's tool calls are matched against them.
+
+    Calls are matched in order, except within any_order groups, and a single optional call is skipped when the tool
+    call doesn't match it. Counts of the remaining calls are kept up to date, so they take constant time.
+    """
+
+    def __init__(self, calls: Iterable[Union[ExpectedFunctionCall, ExpectedFunctionCallGroup]] = ()):
+        self.steps: deque[Step] = deque()
+        self.remaining = 0
+        self.required = 0
+        for call in calls:
+            if isinstance(call, ExpectedFunctionCallGroup):
+                group = CallGroup(call.any_order or [])
+                self.steps.append(group)
+                self.remaining += group.remaining
+                self.required += group.required
+            else:
+                self.steps.append(call)
+                self.remaining += 1
+                self.required += not call.optional
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def match(self, tool_call: ParsedToolCall, call_index: int) -> Tuple[ExpectedFunctionCall, int]:
+        # Consumes the expected call matching tool_call, returning it with the call index advanced past any
+        # skipped optional call
+        next_step = self.popleft()
+        if isinstance(next_step, CallGroup):
+            expected_call = next_step.pop(tool_call)
+            assert expected_call is not None, f"Call {call_index}: Tool call not found in expected call group"
+            self.account(expected_call)
+            if next_step.remaining > 0:
+                self.steps.appendleft(next_step)
+        else:
+            expected_call = next_step
+            # Skip optional calls
+            if self.steps and expected_call.optional and expected_call.name != tool_call.name \
+                    and tool_call.arguments != expected_call.arguments:
+                expected_call = self.popleft()
+                call_index += 1
+
+        assert tool_call.id != "", f"Call {call_index}: Model returned a tool call without a call id"
+        assert tool_call.name == expected_call.name, f"Call {call_index}: Model returned a tool call with an unexpected function name: {tool_call.name}"
+        assert tool_call.arguments == expected_call.arguments, f"Call {call_index}: Model returned a tool call with unexpected arguments"
+
+        return expected_call, call_index
+
+    def popleft(self) -> Step:
+        step = self.steps.popleft()
+        if not isinstance(step, CallGroup):
+            self.account(step)
+        return step
+
+    def account(self, call: ExpectedFunctionCall):
+        self.remaining -= 1
+        self.required -= not call.optional
@@ -0,0 +1,38 @@
+from typing import Dict, Iterable, List, Optional
+from .function_calling_test_suite import TurnMetrics
+
+PERCENTILES = (50, 95, 99)
+
+LATENCY_COLUMNS = ["model", "turns", "retries"] + [
+    f"{metric}_p{percentile}"
+    for metric in ("latency", "time_to_first_chunk", "time_to_first_tool_call")
+    for percentile in PERCENTILES
+] + ["tokens_per_second"]
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    # Linear interpolation between the closest ranks, matching numpy's default
+    if not values:
+        return None
+
+    values = sorted(values)
+    rank = (len(values) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarize_turns(model: str, turns: Iterable[TurnMetrics]) -> Dict[str, str]:
+    turns = list(turns)
+    summary = {"model": model, "turns": str(len(turns)), "retries": str(sum(turn.retries for turn in turns))}
+    for metric in ("latency", "time_to_first_chunk", "time_to_first_tool_call"):
+        values = [getattr(turn, metric) for turn in turns if getattr(turn, metric) is not None]
+        for percent in PERCENTILES:
+            value = percentile(values, percent)
+            summary[f"{metric}_p{percent}"] = f"{value:.3f}" if value is not None else ""
+
+    # Output throughput over the turns that reported usage
+    timed = [turn for turn in turns if turn.completion_tokens is not None and turn.latency]
+    latency = sum(turn.latency for turn in timed)
+    summary["tokens_per_second"] = f"{sum(turn.completion_tokens for turn in timed) / latency:.1f}" if latency else ""
+    return summary
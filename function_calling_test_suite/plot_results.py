@@ -1,10 +1,16 @@
+import argparse
 import json
 import copy
-import sys
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
 import pandas as pd
 import plotly.graph_objs as go
 import plotly.express as px
+import plotly.io as pio
 from plotly.subplots import make_subplots
+from function_calling_test_suite.results_store import MODEL_COLUMN_SUFFIXES, ResultsStore
 
 
 def hex_to_rgba(hex, alpha=0.4):
@@ -13,9 +19,10 @@ def hex_to_rgba(hex, alpha=0.4):
     return 'rgba(' + ', '.join(str(int(hex[i:i + lv // 3], 16)) for i in range(0, lv, lv // 3)) + f', {alpha})'
 
 
-def generate_radar_plots(model_scores):
+def generate_radar_plots(model_scores) -> go.Figure:
     num_models = len(model_scores)
     columns_per_row = 3
+    model_rows = math.ceil(num_models / columns_per_row)
     specs = [[
         {
             'type': 'polar',
@@ -24,7 +31,7 @@ def generate_radar_plots(model_scores):
         None,
         None,
     ]]
-    for _ in range((num_models // columns_per_row)):
+    for _ in range(model_rows):
         specs.append([{'type': 'polar'} for _ in range(columns_per_row)])
 
     fig = make_subplots(
@@ -77,16 +84,15 @@ def generate_radar_plots(model_scores):
             x=0.5, y=1.1
         ),
         width=500 * columns_per_row,
-        height=500 * (num_models // columns_per_row),
+        height=500 * (model_rows + 1),
         autosize=True,
         template='plotly_dark'
     )
 
-    fig.show()
-    fig.write_image("reports/aggregate_summary_radar.svg")
+    return fig
 
 
-def generate_bar_charts(model_scores):
+def generate_bar_charts(model_scores) -> go.Figure:
     models = []
     passed = []
     failed = []
@@ -146,12 +152,11 @@ def generate_bar_charts(model_scores):
         template='plotly_dark'
     )
 
-    # Show the figure
-    fig.show()
-    fig.write_image("reports/aggregate_summary_bar.svg")
+    return fig
 
 
-def generate_pie_charts(model_scores):
+def generate_pie_charts(model_scores) -> Dict[str, go.Figure]:
+    figures = {}
     for model, model_score in model_scores.items():
         test_ids = []
         failures = []
@@ -208,83 +213,136 @@ def generate_pie_charts(model_scores):
             template='plotly_dark'
         )
 
-        fig.show()
-        fig.write_image(f"reports/{model}_failed_pie.svg")
+        figures[model] = fig
 
+    return figures
 
-def plot_results(csv_path: str):
-    df = pd.read_csv(csv_path, quotechar='"', delimiter=",")
 
-    # Collect model scores
-    model_scores = {}
-    model_columns = df.columns[4:]
-    for index, row in df.iterrows():
-        for model in model_columns:
-            pass_rate = row.get(model, "0/0")
-            passed, runs = map(int, pass_rate.split('/')) if '/' in pass_rate else (0, 0)
-
-            if model not in model_scores:
-                model_scores[model] = {
-                    'total_score': {
-                        'runs': 0,
-                        'passed': 0,
-                        'failed': 0
-                    },
-                    'category_scores': {},
-                    'test_case_scores': {}
-                }
+def load_results(path: str) -> pd.DataFrame:
+    # A results store is summarized the same way as the aggregate summary CSV exported from it
+    if path.endswith(".db"):
+        store = ResultsStore(path)
+        try:
+            columns, rows = store.summary()
+        finally:
+            store.close()
+        return pd.DataFrame(rows, columns=columns)
 
-            # Add to total score
-            model_scores[model]['total_score']['runs'] += runs
-            model_scores[model]['total_score']['passed'] += passed
-            model_scores[model]['total_score']['failed'] = model_scores[model]['total_score']['runs'] - \
-                                                           model_scores[model]['total_score']['passed']
-
-            # Set test case score
-            test_id = row.get('test_id', None)
-            categories = row['categories'].split(', ')
-            if test_id and test_id not in model_scores[model]['test_case_scores']:
-                model_scores[model]['test_case_scores'][test_id] = {
-                    'categories': categories,
-                    'runs': runs,
-                    'passed': passed,
-                    'failed': runs - passed,
-                }
+    return pd.read_csv(path, quotechar='"', delimiter=",")
 
-            for category in categories:
-                if category not in model_scores[model]['category_scores']:
-                    model_scores[model]['category_scores'][category] = {
-                        'passed': 0,
-                        'runs': 0
-                    }
 
-                model_scores[model]['category_scores'][category]['passed'] += passed
-                model_scores[model]['category_scores'][category]['runs'] += runs
+def score_table(df: pd.DataFrame) -> pd.DataFrame:
+    # Long format with one row per spec and model. Every model has a pass fraction column, followed by the runs
+    # used, pass rate interval and error columns. Specs a model didn't run count as 0/0.
+    model_columns = [column for column in df.columns[4:] if not column.endswith(MODEL_COLUMN_SUFFIXES)]
+    scores = df.melt(
+        id_vars=['test_id', 'categories'],
+        value_vars=model_columns,
+        var_name='model',
+        value_name='fraction',
+    )
+    counts = scores['fraction'].astype(str).str.extract(r'^(\d+)/(\d+)$').fillna(0).astype(int)
+    scores['passed'] = counts[0]
+    scores['runs'] = counts[1]
+    scores['failed'] = scores['runs'] - scores['passed']
+    scores['categories'] = scores['categories'].fillna('').str.split(', ')
+    return scores.drop(columns='fraction')
 
-    # Normalize scores
-    for model, model_score in model_scores.items():
-        total_passed = model_score['total_score']['passed']
-        total_runs = model_score['total_score']['runs']
-        model_score['total_score']['score'] = 100 * total_passed / float(total_runs) if total_runs > 0 else 0
 
-        for category, category_score in model_score['category_scores'].items():
-            category_passed = category_score['passed']
-            category_runs = category_score['runs']
-            category_score['score'] = 100 * category_passed / float(category_runs) if category_runs > 0 else 0
-            category_score['total_score_contribution'] = 100 * category_passed / float(total_runs) if total_runs > 0 else 0
-            model_score['category_scores'][category] = category_score
+def percentage(passed: pd.Series, runs: pd.Series) -> pd.Series:
+    return (100 * passed / runs.where(runs > 0)).fillna(0.0)
+
 
-        model_scores[model] = model_score
+def score_models(scores: pd.DataFrame) -> Dict[str, Dict]:
+    # Models, categories and specs keep the order they appear in, like the columns and rows of the results
+    totals = scores.groupby('model', sort=False)[['runs', 'passed']].sum()
+    totals['failed'] = totals['runs'] - totals['passed']
+    totals['score'] = percentage(totals['passed'], totals['runs'])
 
+    category_scores = (
+        scores.explode('categories')
+        .groupby(['model', 'categories'], sort=False)[['passed', 'runs']]
+        .sum()
+        .reset_index(level='categories')
+    )
+    category_scores['score'] = percentage(category_scores['passed'], category_scores['runs'])
+    category_scores['total_score_contribution'] = percentage(
+        category_scores['passed'],
+        category_scores.index.to_series().map(totals['runs']),
+    )
+
+    test_case_scores = scores.dropna(subset=['test_id']).drop_duplicates(['model', 'test_id'])
+
+    model_scores = {}
+    for model, total in totals.to_dict('index').items():
+        model_categories = category_scores.loc[[model]].set_index('categories')
+        model_test_cases = test_case_scores[test_case_scores['model'] == model].set_index('test_id')
+        model_scores[model] = {
+            'total_score': total,
+            'category_scores': model_categories.to_dict('index'),
+            'test_case_scores': model_test_cases[['categories', 'runs', 'passed', 'failed']].to_dict('index'),
+        }
+
+    return model_scores
+
+
+def write_image(figure_json: str, path: str):
+    # Runs in a worker process, each with its own kaleido renderer
+    pio.from_json(figure_json).write_image(path)
+
+
+def export_figures(figures: Dict[str, go.Figure], workers: Optional[int] = None):
+    workers = min(workers or os.cpu_count() or 1, len(figures))
+    if workers <= 1:
+        for path, figure in figures.items():
+            figure.write_image(path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(write_image, figure.to_json(), path) for path, figure in figures.items()]
+        for future in futures:
+            future.result()
+
+
+def plot_results(
+        csv_path: str,
+        output_dir: str = "reports",
+        headless: bool = False,
+        workers: Optional[int] = None,
+):
+    model_scores = score_models(score_table(load_results(csv_path)))
     print(f"{json.dumps(model_scores, indent=4)}")
-    generate_radar_plots(model_scores)
-    generate_bar_charts(model_scores)
-    generate_pie_charts(model_scores)
+
+    figures = {
+        os.path.join(output_dir, "aggregate_summary_radar.svg"): generate_radar_plots(model_scores),
+        os.path.join(output_dir, "aggregate_summary_bar.svg"): generate_bar_charts(model_scores),
+    }
+    for model, figure in generate_pie_charts(model_scores).items():
+        figures[os.path.join(output_dir, f"{model}_failed_pie.svg")] = figure
+
+    # Figures are shown in the browser before they're exported, which headless mode skips
+    if not headless:
+        for figure in figures.values():
+            figure.show()
+
+    os.makedirs(output_dir, exist_ok=True)
+    export_figures(figures, workers)
 
 
 def main():
-    csv_path = sys.argv[1] if len(sys.argv) > 1 else "reports/aggregate_summary.csv"
-    plot_results(csv_path)
+    parser = argparse.ArgumentParser(description="Plot the scores of every model in an aggregate summary")
+    parser.add_argument(
+        "path",
+        nargs="?",
+        default="reports/aggregate_summary.csv",
+        help="Aggregate summary CSV or results store database",
+    )
+    parser.add_argument("--output-dir", default="reports", help="Directory to export the SVG figures to")
+    parser.add_argument("--headless", action="store_true", help="Only export the figures, without showing them")
+    parser.add_argument("--workers", default=None, type=int, help="Processes that export figures (all CPUs when unset)")
+    args = parser.parse_args()
+
+    plot_results(args.path, args.output_dir, args.headless, args.workers)
 
 
 if __name__ == "__main__":
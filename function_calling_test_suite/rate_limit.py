@@ -0,0 +1,228 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    # Parses durations in the format used by x-ratelimit-reset-* headers (e.g. "20ms", "1s", "6m0s")
+    if not value:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    matches = DURATION_PATTERN.findall(value)
+    if not matches:
+        return None
+
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in matches)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    resets = [
+        parse_duration(headers.get("x-ratelimit-reset-requests")),
+        parse_duration(headers.get("x-ratelimit-reset-tokens")),
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    # Roughly four characters per token is close enough to budget requests before the provider reports usage
+    text = json.dumps(request.get("messages", []), default=str) + json.dumps(request.get("tools", []), default=str)
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: Optional[float] = None, burst_seconds: float = 1.0):
+        self.per_minute = per_minute
+        self.burst_seconds = burst_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self) -> float:
+        if self.per_minute is None:
+            return float("inf")
+
+        return max(1.0, self.per_minute / 60 * self.burst_seconds)
+
+    def refill(self, now: float):
+        if now <= self.updated:
+            return
+
+        if self.per_minute is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        # Deducts the amount immediately and returns how long the caller must wait for the bucket to cover it.
+        # Letting the level go negative queues concurrent callers behind each other instead of racing.
+        self.refill(now)
+        if self.per_minute is None:
+            return 0.0
+
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level * 60 / self.per_minute
+
+    def adjust(self, amount: float, now: float):
+        self.refill(now)
+        if self.per_minute is not None:
+            self.level = min(self.capacity, self.level + amount)
+
+    def set_rate(self, per_minute: Optional[float], now: float):
+        self.refill(now)
+        self.per_minute = per_minute
+        self.level = min(self.level, self.capacity)
+
+
+class RateLimiter:
+    """
+    Shared request and token budgets for a chat completion client.
+
+    Budgets start at the configured rates (or unlimited) and adapt to the provider: x-ratelimit-* headers set
+    ceilings and sync the remaining budget, 429 responses pause all callers for the Retry-After period and cut
+    the rate multiplicatively, and each success grows the rate additively back towards the ceiling.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: Optional[float] = None,
+            tokens_per_minute: Optional[float] = None,
+            decrease: float = 0.5,
+            increase: float = 1.0,
+            max_retries: int = 5,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.request_ceiling = requests_per_minute
+        self.token_ceiling = tokens_per_minute
+        self.decrease = decrease
+        self.increase = increase
+        self.max_retries = max_retries
+        self.blocked_until = 0.0
+        self.history = deque()
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.history.append((now, tokens))
+            while self.history and self.history[0][0] < now - 60:
+                self.history.popleft()
+
+            # Budgets only start refilling once a Retry-After pause is over, so queued callers don't burst out of it
+            start = max(now, self.blocked_until)
+            return start - now + max(
+                self.requests.reserve(1, start),
+                self.tokens.reserve(tokens, start),
+            )
+
+    def wait(self, tokens: int):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, tokens: int):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def observe(self, headers: Mapping[str, str], estimated_tokens: int, used_tokens: Optional[int]):
+        with self.lock:
+            now = time.monotonic()
+            if used_tokens is not None:
+                self.tokens.adjust(estimated_tokens - used_tokens, now)
+
+            self.apply_limits(headers, now)
+
+            # Additive increase: each success grows the budgets by one request's worth, up to the known ceilings
+            grow = ((self.requests, 1, self.request_ceiling), (self.tokens, used_tokens or estimated_tokens, self.token_ceiling))
+            for bucket, amount, ceiling in grow:
+                if bucket.per_minute is None:
+                    continue
+
+                grown = bucket.per_minute + amount * self.increase
+                bucket.set_rate(min(grown, ceiling) if ceiling is not None else grown, now)
+
+            remaining_requests = parse_int(headers.get("x-ratelimit-remaining-requests"))
+            remaining_tokens = parse_int(headers.get("x-ratelimit-remaining-tokens"))
+            if remaining_requests is not None and self.requests.per_minute is not None:
+                self.requests.level = min(self.requests.level, remaining_requests)
+            if remaining_tokens is not None and self.tokens.per_minute is not None:
+                self.tokens.level = min(self.tokens.level, remaining_tokens)
+
+    def throttle(self, headers: Mapping[str, str]):
+        with self.lock:
+            now = time.monotonic()
+            self.throttled += 1
+            self.apply_limits(headers, now)
+
+            # Requests already in flight when the limit was hit fail together, so only the first one cuts the rate
+            congested = now < self.blocked_until
+            retry_after = parse_retry_after(headers)
+            self.blocked_until = max(self.blocked_until, now + (retry_after if retry_after is not None else 1.0))
+            if congested:
+                return
+
+            # Multiplicative decrease of whichever budget the provider reports as exhausted, defaulting to requests
+            buckets = []
+            if parse_int(headers.get("x-ratelimit-remaining-tokens")) == 0:
+                buckets.append((self.tokens, sum(tokens for _, tokens in self.history)))
+            if parse_int(headers.get("x-ratelimit-remaining-requests")) == 0 or not buckets:
+                buckets.append((self.requests, len(self.history)))
+
+            window = max(1.0, now - self.history[0][0]) if self.history else 60.0
+            for bucket, observed in buckets:
+                current = bucket.per_minute if bucket.per_minute is not None else observed * 60 / min(window, 60.0)
+                bucket.set_rate(max(1.0, current * self.decrease), now)
+                bucket.level = min(bucket.level, 0.0)
+
+    def apply_limits(self, headers: Mapping[str, str], now: float):
+        request_limit = parse_int(headers.get("x-ratelimit-limit-requests"))
+        token_limit = parse_int(headers.get("x-ratelimit-limit-tokens"))
+        if request_limit:
+            self.request_ceiling = min(request_limit, self.request_ceiling or request_limit)
+        if token_limit:
+            self.token_ceiling = min(token_limit, self.token_ceiling or token_limit)
+
+        for bucket, ceiling in ((self.requests, self.request_ceiling), (self.tokens, self.token_ceiling)):
+            if ceiling is not None and (bucket.per_minute is None or bucket.per_minute > ceiling):
+                bucket.set_rate(ceiling, now)
@@ -0,0 +1,100 @@
+import gzip
+import json
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+
+def index_path(path: str) -> str:
+    return f"{path}.index"
+
+
+class ReportWriter:
+    """
+    Appends one compact JSON line per finished test to a report file, so memory doesn't grow with the session.
+
+    Reports ending in .gz are written as one gzip member per line, which together are a regular gzip file. The index
+    file next to the report has one [nodeid, offset, length] line per record, so a single test's record can be read
+    without decompressing the others. Both files are flushed after every record. When appending, a record that a
+    crash left unindexed is cut off, and the index points at the latest record of each test.
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.compress = path.endswith(".gz")
+        self.lock = threading.Lock()
+        self.records = 0
+
+        end = 0
+        if append and os.path.exists(path) and os.path.exists(index_path(path)):
+            for _, offset, length in read_index(path):
+                end = max(end, offset + length)
+
+        self.file = open(path, "r+b" if end else "wb")
+        self.file.truncate(end)
+        self.file.seek(end)
+        self.index = open(index_path(path), "a" if end else "w")
+
+    def write(self, record: Dict[str, Any]):
+        data = (json.dumps(record, separators=(",", ":"), default=list) + "\n").encode("utf-8")
+        if self.compress:
+            data = gzip.compress(data)
+
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(data)
+            self.file.flush()
+            self.index.write(json.dumps([record["nodeid"], offset, len(data)]) + "\n")
+            self.index.flush()
+            self.records += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            self.index.close()
+
+
+def read_index(path: str) -> List[List]:
+    entries = []
+    with open(index_path(path), "r") as index:
+        for line in index:
+            # The last line may be incomplete after a crash
+            if line.endswith("\n"):
+                entries.append(json.loads(line))
+    return entries
+
+
+def iter_report(path: str) -> Iterator[Dict[str, Any]]:
+    # Streams every record in the order it was written, one line in memory at a time
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as report:
+        try:
+            for line in report:
+                if line.endswith("\n"):
+                    yield json.loads(line)
+        except EOFError:
+            # A gzip member cut off by a crash
+            return
+
+
+def read_record(path: str, nodeid: str, index: Optional[Dict[str, List[int]]] = None) -> Optional[Dict[str, Any]]:
+    # Pass an index from load_index to look up several records without reading the index file again
+    if index is None:
+        index = load_index(path)
+    if nodeid not in index:
+        return None
+
+    offset, length = index[nodeid]
+    with open(path, "rb") as report:
+        report.seek(offset)
+        data = report.read(length)
+
+    return json.loads(gzip.decompress(data) if path.endswith(".gz") else data)
+
+
+def load_index(path: str) -> Dict[str, List[int]]:
+    # Later records of a test replace earlier ones, e.g. runs repeated after --resume
+    return {nodeid: [offset, length] for nodeid, offset, length in read_index(path)}
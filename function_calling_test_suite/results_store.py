@@ -0,0 +1,240 @@
+import csv
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Tuple
+from .function_calling_test_suite import TurnMetrics
+from .metrics import LATENCY_COLUMNS, summarize_turns
+from .sampling import wilson_interval
+
+SPEC_COLUMNS = ["test_id", "categories", "description", "prompt"]
+
+# The latency columns of a model in the summary, named like the columns of the latency CSV
+SUMMARY_LATENCY_COLUMNS = ["latency_p50", "latency_p95", "latency_p99", "tokens_per_second"]
+
+# Every model has a passed/total column, followed by these columns
+MODEL_COLUMN_SUFFIXES = (" runs", " interval", " errors") + tuple(f" {column}" for column in SUMMARY_LATENCY_COLUMNS)
+
+
+class ResultsStore:
+    """
+    SQLite store of every spec run, shared by all sessions that write to the same file.
+
+    Each session adds its runs in a single transaction, so sessions for different models (or the same model)
+    can finish at the same time without losing each other's results. The aggregate summary CSV and the latency
+    CSV are derived from the store: for every spec and model, they report the runs of the latest session that
+    ran that spec for that model. Runs with an ERROR outcome failed for infrastructure reasons, so they're counted
+    separately and left out of the pass rate.
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60.0, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                uid TEXT NOT NULL,
+                finished REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS specs (
+                test_id TEXT PRIMARY KEY,
+                categories TEXT NOT NULL,
+                description TEXT,
+                prompt TEXT
+            );
+            CREATE TABLE IF NOT EXISTS runs (
+                session INTEGER NOT NULL REFERENCES sessions (id),
+                model TEXT NOT NULL,
+                test_id TEXT NOT NULL,
+                run_id TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                start REAL,
+                stop REAL,
+                turns TEXT
+            );
+            CREATE INDEX IF NOT EXISTS runs_spec ON runs (test_id, model, session);
+        """)
+
+    def empty(self) -> bool:
+        return self.connection.execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is None
+
+    def record_session(self, specs: Iterable[Dict[str, Any]], runs: Iterable[Dict[str, Any]]) -> int:
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent sessions queue instead of failing to upgrade
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            session = self.connection.execute(
+                "INSERT INTO sessions (uid, finished) VALUES (?, ?)", (uuid.uuid4().hex, time.time())
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO specs (test_id, categories, description, prompt) VALUES (?, ?, ?, ?)",
+                [(spec["test_id"], spec["categories"], spec["description"], spec["prompt"]) for spec in specs],
+            )
+            self.connection.executemany(
+                """
+                INSERT INTO runs (session, model, test_id, run_id, outcome, start, stop, turns)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        session,
+                        run["model"],
+                        run["test_id"],
+                        run["run_id"],
+                        run["outcome"],
+                        run.get("start"),
+                        run.get("stop"),
+                        json.dumps(run.get("turns", [])),
+                    )
+                    for run in runs
+                ],
+            )
+            self.connection.execute("COMMIT")
+            return session
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def import_summary_csv(self, csv_path: str):
+        # Seeds the store with the pass fractions of an aggregate CSV written before the store existed
+        with open(csv_path, mode="r", newline="") as csvfile:
+            reader = csv.DictReader(csvfile)
+            models = [
+                column for column in (reader.fieldnames or [])[len(SPEC_COLUMNS):]
+                if not column.endswith(MODEL_COLUMN_SUFFIXES)
+            ]
+            specs, runs = [], []
+            for row in reader:
+                specs.append({column: row.get(column, "") for column in SPEC_COLUMNS})
+                for model in models:
+                    if "/" not in (row.get(model) or ""):
+                        continue
+
+                    passed, total = map(int, row[model].split("/"))
+                    for run in range(total):
+                        runs.append({
+                            "model": model,
+                            "test_id": row["test_id"],
+                            "run_id": f"{row['test_id']}-{run}",
+                            "outcome": "PASSED" if run < passed else "FAILED",
+                        })
+
+        self.record_session(specs, runs)
+
+    def latest_runs(self) -> List[sqlite3.Row]:
+        return self.connection.execute("""
+            SELECT runs.* FROM runs
+            JOIN (
+                SELECT test_id, model, MAX(session) AS session FROM runs GROUP BY test_id, model
+            ) AS latest USING (test_id, model, session)
+            ORDER BY runs.rowid
+        """).fetchall()
+
+    def models(self) -> List[str]:
+        # In the order they were first recorded, which keeps the columns of the derived CSV stable
+        return [row[0] for row in self.connection.execute(
+            "SELECT model FROM runs GROUP BY model ORDER BY MIN(session), MIN(rowid)"
+        )]
+
+    def summary(
+            self,
+            confidence: float = 0.95,
+            intervals: bool = False,
+            latency: bool = False,
+    ) -> Tuple[List[str], List[Dict[str, str]]]:
+        # The runs and interval columns are only added with intervals, the latency columns with latency for models
+        # whose runs have turns, and a model's errors column only when any of its runs ended in an infrastructure
+        # error, so the CSV keeps its original columns otherwise
+        counts: Dict[Tuple[str, str], List[int]] = {}
+        turns: Dict[Tuple[str, str], List[TurnMetrics]] = {}
+        for run in self.latest_runs():
+            count = counts.setdefault((run["test_id"], run["model"]), [0, 0, 0])
+            if latency:
+                run_turns = turns.setdefault((run["test_id"], run["model"]), [])
+                run_turns.extend(TurnMetrics(**turn) for turn in json.loads(run["turns"] or "[]"))
+            if run["outcome"] == "ERROR":
+                count[2] += 1
+                continue
+            count[0] += run["outcome"] == "PASSED"
+            count[1] += 1
+
+        models = self.models()
+        errored = {model for (_, model), count in counts.items() if count[2]}
+        timed = {model for (_, model), model_turns in turns.items() if model_turns}
+        columns = list(SPEC_COLUMNS)
+        for model in models:
+            columns.append(model)
+            if intervals:
+                columns += [f"{model} runs", f"{model} interval"]
+            if model in timed:
+                columns += [f"{model} {column}" for column in SUMMARY_LATENCY_COLUMNS]
+            if model in errored:
+                columns.append(f"{model} errors")
+
+        specs = {row["test_id"]: dict(row) for row in self.connection.execute("SELECT * FROM specs")}
+        rows = []
+        for test_id in sorted({test_id for test_id, _ in counts}):
+            row = {column: "" for column in columns}
+            row.update(specs.get(test_id, {"test_id": test_id}))
+            for model in models:
+                if (test_id, model) not in counts:
+                    continue
+
+                passed, total, errors = counts[(test_id, model)]
+                low, high = wilson_interval(passed, total, confidence)
+                row[model] = f"{passed}/{total}"
+                row[f"{model} runs"] = str(total)
+                row[f"{model} interval"] = f"{low:.3f}-{high:.3f}"
+                row[f"{model} errors"] = str(errors)
+                if turns.get((test_id, model)):
+                    latency_summary = summarize_turns(model, turns[(test_id, model)])
+                    row.update({f"{model} {column}": latency_summary[column] for column in SUMMARY_LATENCY_COLUMNS})
+            rows.append(row)
+
+        return columns, rows
+
+    def latency_summary(self) -> List[Dict[str, str]]:
+        turns: Dict[str, List[TurnMetrics]] = {}
+        for run in self.latest_runs():
+            model_turns = turns.setdefault(run["model"], [])
+            model_turns.extend(TurnMetrics(**turn) for turn in json.loads(run["turns"] or "[]"))
+
+        # Runs imported from a summary CSV have no turns
+        return [summarize_turns(model, model_turns) for model, model_turns in sorted(turns.items()) if model_turns]
+
+    def export_summary_csv(
+            self,
+            csv_path: str,
+            confidence: float = 0.95,
+            intervals: bool = False,
+            latency: bool = False,
+    ):
+        columns, rows = self.summary(confidence, intervals, latency)
+        write_csv(csv_path, columns, rows)
+
+    def export_latency_csv(self, csv_path: str):
+        write_csv(csv_path, LATENCY_COLUMNS, self.latency_summary())
+
+    def close(self):
+        self.connection.close()
+
+
+def write_csv(csv_path: str, columns: List[str], rows: Iterable[Dict[str, Any]]):
+    # Replaced atomically, so concurrent exports never leave a partially written file behind
+    if os.path.dirname(csv_path):
+        os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+
+    temporary_path = f"{csv_path}.{os.getpid()}.tmp"
+    with open(temporary_path, mode="w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    os.replace(temporary_path, csv_path)
+
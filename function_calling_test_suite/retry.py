@@ -0,0 +1,79 @@
+import random
+import threading
+from collections import deque
+from typing import Optional
+import httpx
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from .metrics import percentile
+
+
+class InfrastructureError(Exception):
+    """
+    A chat completion that failed for reasons unrelated to the model's answer, e.g. connection errors, 5xx
+    responses, truncated streams or rate limits, after every retry was used up. Runs that end with one are
+    reported as ERROR instead of FAILED.
+    """
+
+
+class TruncatedStream(Exception):
+    pass
+
+
+def is_transient(error: BaseException) -> bool:
+    return isinstance(error, (
+        APIConnectionError,  # Includes timeouts
+        InternalServerError,
+        RateLimitError,
+        httpx.TransportError,  # Raised while reading a stream, e.g. when the connection drops mid-response
+        TruncatedStream,
+    ))
+
+
+class RetryPolicy:
+    """
+    Retries chat completions that failed with transient errors, waiting an exponentially growing delay with full
+    jitter between attempts, and decides when to hedge a slow request with a duplicate.
+
+    Hedging is enabled with hedge_percentile: once min_samples latencies were observed, a request that hasn't
+    completed within that percentile of the recent latencies is sent again, and the first response wins.
+    """
+
+    def __init__(
+            self,
+            max_retries: int = 3,
+            base_delay: float = 1.0,
+            max_delay: float = 30.0,
+            hedge_percentile: Optional[float] = None,
+            min_samples: int = 20,
+            window: int = 200,
+            seed: Optional[int] = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.random = random.Random(seed)
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+
+    def backoff(self, attempt: int) -> float:
+        with self.lock:
+            self.retries += 1
+            return self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def observe(self, latency: float):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            return percentile(list(self.latencies), self.hedge_percentile)
@@ -0,0 +1,85 @@
+import math
+import threading
+from statistics import NormalDist
+from typing import Dict, Optional, Tuple
+
+WILSON = "wilson"
+SPRT = "sprt"
+METHODS = (WILSON, SPRT)
+
+
+def wilson_interval(passed: int, total: int, confidence: float = 0.95) -> Tuple[float, float]:
+    if total == 0:
+        return 0.0, 1.0
+
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    rate = passed / total
+    center = (rate + z * z / (2 * total)) / (1 + z * z / total)
+    margin = z * math.sqrt(rate * (1 - rate) / total + z * z / (4 * total * total)) / (1 + z * z / total)
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def sprt_decision(passed: int, total: int, threshold: float, width: float, confidence: float = 0.95) -> Optional[bool]:
+    # Wald's sequential probability ratio test of a pass rate of threshold - width/2 against threshold + width/2,
+    # with both error rates set to 1 - confidence. Returns whether the pass rate is above the threshold, or None
+    # while the evidence is inconclusive.
+    low = min(max(threshold - width / 2, 1e-6), 1 - 1e-6)
+    high = min(max(threshold + width / 2, 1e-6), 1 - 1e-6)
+    error = 1 - confidence
+    ratio = passed * math.log(high / low) + (total - passed) * math.log((1 - high) / (1 - low))
+    if ratio >= math.log((1 - error) / error):
+        return True
+    if ratio <= math.log(error / (1 - error)):
+        return False
+
+    return None
+
+
+class AdaptiveSampler:
+    """
+    Tracks the outcomes of each spec's runs and decides when a spec has been run often enough.
+
+    With the wilson method a spec is done once the Wilson interval of its pass rate is no wider than width, and with
+    the sprt method once a sequential probability ratio test decides whether its pass rate is above threshold.
+    Outcomes are keyed by run, so recording the same run twice doesn't count it twice. A spec that isn't done yet
+    still has at most the runs it was collected with: the runs that done specs skip aren't handed on to it.
+    """
+
+    def __init__(self, method: str, width: float = 0.3, threshold: float = 0.5, confidence: float = 0.95):
+        if method not in METHODS:
+            raise ValueError(f"Unknown adaptive sampling method: {method}")
+
+        self.method = method
+        self.width = width
+        self.threshold = threshold
+        self.confidence = confidence
+        self.outcomes: Dict[str, Dict[str, bool]] = {}
+        self.lock = threading.Lock()
+
+    def record(self, spec_id: str, run_id: str, passed: bool):
+        with self.lock:
+            self.outcomes.setdefault(spec_id, {})[run_id] = passed
+
+    def counts(self, spec_id: str) -> Tuple[int, int]:
+        with self.lock:
+            outcomes = self.outcomes.get(spec_id, {})
+            return sum(outcomes.values()), len(outcomes)
+
+    def interval(self, spec_id: str) -> Tuple[float, float]:
+        return wilson_interval(*self.counts(spec_id), self.confidence)
+
+    def done(self, spec_id: str) -> bool:
+        passed, total = self.counts(spec_id)
+        if total == 0:
+            return False
+
+        if self.method == SPRT:
+            return sprt_decision(passed, total, self.threshold, self.width, self.confidence) is not None
+
+        low, high = wilson_interval(passed, total, self.confidence)
+        return high - low <= self.width
+
+    def reason(self, spec_id: str) -> str:
+        passed, total = self.counts(spec_id)
+        low, high = self.interval(spec_id)
+        return f"Adaptive sampling stopped after {passed}/{total} passed runs (pass rate interval {low:.2f}-{high:.2f})"
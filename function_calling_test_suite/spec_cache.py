@@ -0,0 +1,206 @@
+import fnmatch
+import hashlib
+import json
+import os
+import pickle
+import platform
+import threading
+from typing import Dict, List, Optional, Tuple
+import pydantic
+import yaml
+from . import function_calling_test_suite
+from .function_calling_test_suite import TestCase
+
+INDEX_FILE = "index.json"
+
+# Bumped when the layout of the index or the pickles changes
+FORMAT_VERSION = 2
+
+# The libyaml loader is several times faster than the pure-Python one when PyYAML was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# A spec document is either a parsed TestCase or the error raised while parsing it
+Spec = Tuple[str, TestCase | str]
+
+
+def parse_spec_file(file_path: str, content: Optional[bytes] = None, spec_filter: str = "*") -> List[Spec]:
+    if content is None:
+        with open(file_path, "rb") as file:
+            content = file.read()
+
+    file_name = os.path.basename(file_path)
+    specs = []
+    for index, item in enumerate(yaml.load_all(content, Loader=YAML_LOADER)):
+        test_id = f"{file_name}-{index}"
+        if not fnmatch.fnmatch(test_id, spec_filter):
+            continue
+
+        try:
+            specs.append((test_id, TestCase.parse_yaml(item)))
+        except Exception as e:
+            specs.append((test_id, str(e)))
+
+    return specs
+
+
+def cache_version() -> str:
+    # Pickles are only valid for the code that parsed them, so the version covers the source of the spec parsing and
+    # the Python and pydantic versions the TestCases were pickled with
+    digest = hashlib.sha256(f"{FORMAT_VERSION}-{platform.python_version()}-{pydantic.VERSION}".encode("utf-8"))
+    for module_path in (function_calling_test_suite.__file__, __file__):
+        with open(module_path, "rb") as module:
+            digest.update(module.read())
+    return digest.hexdigest()[:16]
+
+
+def filter_specs(specs: List[Spec], spec_filter: str) -> List[Spec]:
+    return [(test_id, spec) for test_id, spec in specs if fnmatch.fnmatch(test_id, spec_filter)]
+
+
+class SpecCache:
+    """
+    On-disk cache of parsed spec files, so collection can skip YAML parsing and TestCase validation.
+
+    index.json maps each spec file path to the mtime, size and content hash it was parsed at, the test IDs of its
+    documents, and a pickle of the parsed documents named after the content hash. Files whose mtime and size are
+    unchanged are trusted, others are re-hashed and only re-parsed when their content changed. Files without a test
+    ID matching the spec filter aren't loaded at all.
+
+    The index records the cache_version it was written with, and pickles are named after it as well. A cache of
+    another version is discarded as a whole, so a change to TestCase or the parsing never reuses stale pickles.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.version = cache_version()
+        self.lock = threading.Lock()
+        self.index: Dict[str, Dict] = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, "r") as index_file:
+                    index = json.load(index_file)
+            except ValueError:
+                index = {}
+            if index.get("version") == self.version:
+                self.index = index["files"]
+            else:
+                # Rewritten on close, which also removes the pickles of the old version
+                self.dirty = True
+
+    def load(self, file_path: str, spec_filter: str = "*") -> List[Spec]:
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        with self.lock:
+            entry = self.index.get(file_path)
+            if entry is not None and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                if not any(fnmatch.fnmatch(test_id, spec_filter) for test_id in entry["test_ids"]):
+                    return []
+
+                specs = self.read(entry["sha256"])
+                if specs is not None:
+                    self.hits += 1
+                    return filter_specs(specs, spec_filter)
+
+            with open(file_path, "rb") as file:
+                content = file.read()
+            sha256 = hashlib.sha256(content).hexdigest()
+
+            specs = self.read(sha256) if entry is not None and entry["sha256"] == sha256 else None
+            if specs is None:
+                self.misses += 1
+                specs = parse_spec_file(file_path, content)
+                self.write(sha256, specs)
+            else:
+                self.hits += 1
+
+            self.index[file_path] = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": sha256,
+                "test_ids": [test_id for test_id, _ in specs],
+            }
+            self.dirty = True
+            return filter_specs(specs, spec_filter)
+
+    def data_name(self, sha256: str) -> str:
+        return f"{self.version}-{sha256}.pickle"
+
+    def data_path(self, sha256: str) -> str:
+        return os.path.join(self.directory, self.data_name(sha256))
+
+    def read(self, sha256: str) -> Optional[List[Spec]]:
+        try:
+            with open(self.data_path(sha256), "rb") as data:
+                return pickle.load(data)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+
+    def write(self, sha256: str, specs: List[Spec]):
+        # Written to a temporary file first so concurrent collections never read a partial pickle
+        temporary_path = f"{self.data_path(sha256)}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as data:
+            pickle.dump(specs, data, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self.data_path(sha256))
+
+    def close(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            # Drop pickles that no indexed file refers to anymore
+            referenced = {self.data_name(entry["sha256"]) for entry in self.index.values()}
+            for name in os.listdir(self.directory):
+                if name.endswith(".pickle") and name not in referenced:
+                    os.remove(os.path.join(self.directory, name))
+
+            temporary_path = os.path.join(self.directory, f"{INDEX_FILE}.{os.getpid()}.tmp")
+            with open(temporary_path, "w") as index_file:
+                json.dump({"version": self.version, "files": self.index}, index_file)
+            os.replace(temporary_path, os.path.join(self.directory, INDEX_FILE))
+            self.dirty = False
+
+
+def load_test_cases(
+    spec_run_count: int,
+    spec_filter: str,
+    spec_dir: str,
+    stream: bool,
+    use_system_prompt: bool,
+    spec_cache: Optional[SpecCache] = None,
+) -> List[Tuple[str, bool, bool, TestCase]]:
+    suite_test_cases = []
+    test_case_files = [
+        f for f in os.listdir(spec_dir) if f.endswith(".yaml") or f.endswith(".yml")
+    ]
+
+    for test_case_file in test_case_files:
+        file_path = os.path.join(spec_dir, test_case_file)
+        if spec_cache is not None:
+            specs = spec_cache.load(file_path, spec_filter)
+        else:
+            specs = parse_spec_file(file_path, spec_filter=spec_filter)
+
+        for test_id, spec in specs:
+            if not isinstance(spec, TestCase):
+                index = test_id.rsplit("-", 1)[1]
+                print(f"Error parsing {test_case_file} at index {index}: {spec}")
+                continue
+
+            # Every run shares the parsed spec, see the test_case fixture
+            for run in range(spec_run_count):
+                suite_test_cases.append(
+                    (
+                        f"{test_id}-{run}",
+                        stream,
+                        use_system_prompt,
+                        spec,
+                    )
+                )
+
+    return suite_test_cases
@@ -0,0 +1,301 @@
+import argparse
+import copy
+import itertools
+import json
+import os
+import random
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import yaml
+from .function_calling_test_suite import TestCase
+
+# The libyaml dumper is several times faster than the pure-Python one when PyYAML was built with it
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+SCALAR_TYPES = ["integer", "number", "string", "boolean", "enum", "array"]
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliett", "kilo", "lima"]
+
+
+class GeneratorConfig:
+    def __init__(
+            self,
+            functions: int = 4,
+            parameters: int = 2,
+            depth: int = 1,
+            chain_length: int = 2,
+            groups: int = 0,
+            group_width: int = 2,
+            optional_rate: float = 0.0,
+            final_answer: bool = True,
+            seed: int = 0,
+    ):
+        self.functions = max(1, functions)
+        self.parameters = max(1, parameters)
+        self.depth = max(1, depth)
+        self.chain_length = max(1, chain_length)
+        self.groups = min(max(0, groups), self.chain_length)
+        self.group_width = max(2, group_width)
+        self.optional_rate = optional_rate
+        self.final_answer = final_answer
+        self.seed = seed
+
+
+class SpecGenerator:
+    """
+    Generates synthetic spec documents in the YAML format of the spec files, for stress testing models and the suite.
+
+    Every spec offers config.functions functions whose parameters are objects of config.parameters properties, nested
+    config.depth levels deep. Its expected calls are config.chain_length steps, config.groups of which are any_order
+    groups of config.group_width calls. A single call that follows another single call takes that call's result as
+    its first string argument. With config.optional_rate, optional calls are added before single calls and at the end.
+
+    Each spec is generated from its own random state, seeded with the seed and the spec's index, so spec n is the same
+    however many specs are generated.
+    """
+
+    def __init__(self, config: GeneratorConfig):
+        self.config = config
+
+    def documents(self, count: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        indices = itertools.count() if count is None else range(count)
+        for index in indices:
+            yield self.document(index)
+
+    def test_cases(self, count: Optional[int] = None) -> Iterator[TestCase]:
+        for document in self.documents(count):
+            # parse_yaml replaces the expected calls of the document it's given
+            yield TestCase.parse_yaml(copy.deepcopy(document))
+
+    def document(self, index: int) -> Dict[str, Any]:
+        config = self.config
+        rng = random.Random(f"{config.seed}-{index}")
+        functions = [
+            {
+                "name": f"func{number}",
+                "description": f"Performs func{number}",
+                "parameters": self.schema(rng, config.depth),
+            }
+            for number in range(1, config.functions + 1)
+        ]
+
+        group_steps = set(rng.sample(range(config.chain_length), config.groups))
+        steps = []
+        for step in range(config.chain_length):
+            if step in group_steps:
+                members = rng.sample(functions, min(config.group_width, len(functions)))
+                members += rng.choices(functions, k=config.group_width - len(members))
+                group = [self.call(rng, function, len(steps), member) for member, function in enumerate(members)]
+                steps.append({"any_order": group})
+                continue
+
+            call = self.call(rng, rng.choice(functions), len(steps))
+            previous = steps[-1] if steps else None
+            if previous is not None and "any_order" not in previous:
+                call["chained"] = self.chain(call, previous, functions)
+            steps.append(call)
+
+        expected_calls = []
+        for step in steps + [None]:
+            if rng.random() < config.optional_rate and (step is None or "any_order" not in step):
+                optional = self.optional_call(rng, functions, step, len(expected_calls))
+                if optional is not None:
+                    expected_calls.append(optional)
+            if step is not None:
+                expected_calls.append(step)
+
+        prompt = " Then ".join(self.describe(call) for call in expected_calls)
+        prompt = prompt[0].upper() + prompt[1:]
+        last = steps[-1]["any_order"] if "any_order" in steps[-1] else [steps[-1]]
+        results = ", ".join(f'"{call["result"]}"' for call in last)
+        prompt += " Respond with the results of the last calls." if len(last) > 1 else " Respond with the last result."
+
+        categories = ["synthetic"]
+        if config.chain_length > 1:
+            categories.append("sequenced")
+        if any("chained" in call for call in expected_calls):
+            categories.append("chained")
+        if config.groups:
+            categories.append("grouped")
+
+        document = {
+            "categories": categories,
+            "description": (
+                f"Synthetic spec {index} (seed {config.seed}): {config.functions} functions, schema depth "
+                f"{config.depth}, {config.chain_length} steps, {config.groups} groups of {config.group_width} calls"
+            ),
+            "prompt": prompt,
+            "available_functions": functions,
+            "expected_function_calls": [self.strip(call) for call in expected_calls],
+        }
+        if config.final_answer:
+            document["final_answer_should"] = f"The answer should include {results}"
+        return document
+
+    def schema(self, rng: random.Random, depth: int) -> Dict[str, Any]:
+        properties = {}
+        for number in range(1, self.config.parameters + 1):
+            name = f"param{number}"
+            # The last property of every level but the deepest is nested, so the schema always has the full depth
+            if depth > 1 and number == self.config.parameters:
+                properties[name] = {**self.schema(rng, depth - 1), "description": f"Param {number}"}
+                continue
+
+            kind = rng.choice(SCALAR_TYPES)
+            if kind == "enum":
+                properties[name] = {"type": "string", "enum": rng.sample(WORDS, 3)}
+            elif kind == "array":
+                properties[name] = {"type": "array", "items": {"type": "integer"}}
+            else:
+                properties[name] = {"type": kind}
+            properties[name]["description"] = f"Param {number}"
+
+        # Chained calls pass the previous result as the first string property
+        if not any(schema.get("type") == "string" and "enum" not in schema for schema in properties.values()):
+            name = next((name for name, schema in properties.items() if schema["type"] != "object"), None)
+            name = name or f"param{len(properties) + 1}"
+            properties[name] = {"type": "string", "description": f"Param {name[len('param'):]}"}
+
+        return {"type": "object", "properties": properties, "required": list(properties)}
+
+    def value(self, rng: random.Random, schema: Dict[str, Any]) -> Any:
+        kind = schema.get("type")
+        if "enum" in schema:
+            return rng.choice(schema["enum"])
+        if kind == "object":
+            return {name: self.value(rng, prop) for name, prop in schema["properties"].items()}
+        if kind == "array":
+            return [rng.randint(0, 99) for _ in range(rng.randint(1, 3))]
+        if kind == "integer":
+            return rng.randint(0, 999)
+        if kind == "number":
+            return rng.randint(0, 9999) / 100
+        if kind == "boolean":
+            return rng.random() < 0.5
+        return f"{rng.choice(WORDS)}-{rng.randint(0, 999)}"
+
+    def call(
+            self,
+            rng: random.Random,
+            function: Dict[str, Any],
+            step: int,
+            member: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        position = f"{step + 1}" if member is None else f"{step + 1}.{member + 1}"
+        return {
+            "name": function["name"],
+            "arguments": self.value(rng, function["parameters"]),
+            "result": f"This is the output of {function['name']} in step {position}",
+        }
+
+    @staticmethod
+    def chain(call: Dict[str, Any], previous: Dict[str, Any], functions: List[Dict[str, Any]]) -> Dict[str, str]:
+        schema = next(function for function in functions if function["name"] == call["name"])["parameters"]
+        parameter = next(
+            name for name, prop in schema["properties"].items() if prop.get("type") == "string" and "enum" not in prop
+        )
+        call["arguments"][parameter] = previous["result"]
+        return {"parameter": parameter, "source": previous["name"]}
+
+    def optional_call(
+            self,
+            rng: random.Random,
+            functions: List[Dict[str, Any]],
+            following: Optional[Dict[str, Any]],
+            position: int,
+    ) -> Optional[Dict[str, Any]]:
+        # An optional call is only skipped when the call that follows it has a different name, and mustn't be
+        # mistaken for the call whose result a chained call takes
+        excluded = set()
+        if following is not None:
+            excluded = {following["name"], following.get("chained", {}).get("source")}
+        candidates = [function for function in functions if function["name"] not in excluded]
+        if not candidates:
+            return None
+
+        call = self.call(rng, rng.choice(candidates), position)
+        call["result"] = f"This is the output of the optional call to {call['name']}"
+        call["optional"] = True
+        return call
+
+    @staticmethod
+    def describe(call: Dict[str, Any]) -> str:
+        if "any_order" in call:
+            calls = ", ".join(f"{call['name']} with {json.dumps(call['arguments'])}" for call in call["any_order"])
+            return f"call these functions in any order: {calls}."
+
+        if call.get("optional"):
+            return f"if you want, call {call['name']} with {json.dumps(call['arguments'])}."
+
+        if "chained" in call:
+            parameter = call["chained"]["parameter"]
+            others = {name: value for name, value in call["arguments"].items() if name != parameter}
+            return (
+                f"call {call['name']} with {parameter} set to the result of the last {call['chained']['source']} call"
+                f"{f' and {json.dumps(others)}' if others else ''}."
+            )
+
+        return f"call {call['name']} with {json.dumps(call['arguments'])}."
+
+    @staticmethod
+    def strip(call: Dict[str, Any]) -> Dict[str, Any]:
+        if "any_order" in call:
+            return {"any_order": [SpecGenerator.strip(member) for member in call["any_order"]]}
+        return {key: value for key, value in call.items() if key != "chained"}
+
+
+def write_spec_files(
+        documents: Iterable[Dict[str, Any]],
+        output_dir: str,
+        specs_per_file: int = 100,
+        prefix: str = "synthetic",
+) -> List[str]:
+    # Writes the documents in files of specs_per_file each, holding a single file's documents in memory at a time
+    os.makedirs(output_dir, exist_ok=True)
+    documents = iter(documents)
+    paths = []
+    for number in itertools.count():
+        chunk = list(itertools.islice(documents, specs_per_file))
+        if not chunk:
+            break
+
+        path = os.path.join(output_dir, f"{prefix}_{number:04d}.yaml")
+        with open(path, "w") as file:
+            yaml.dump_all(chunk, file, Dumper=YAML_DUMPER, explicit_start=True, sort_keys=False, width=120)
+        paths.append(path)
+
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic YAML test specs for stress testing")
+    parser.add_argument("--output-dir", default="specs/synthetic", help="Directory to write the spec files to")
+    parser.add_argument("--specs", default=100, type=int, help="Number of specs to generate")
+    parser.add_argument("--specs-per-file", default=100, type=int, help="Number of specs in each spec file")
+    parser.add_argument("--prefix", default="synthetic", help="Name prefix of the spec files")
+    parser.add_argument("--functions", default=4, type=int, help="Number of available functions of every spec")
+    parser.add_argument("--parameters", default=2, type=int, help="Number of properties of every parameters object")
+    parser.add_argument("--depth", default=1, type=int, help="Nesting depth of the parameters objects")
+    parser.add_argument("--chain-length", default=2, type=int, help="Number of steps of expected calls")
+    parser.add_argument("--groups", default=0, type=int, help="Number of steps that are any_order groups")
+    parser.add_argument("--group-width", default=2, type=int, help="Number of calls in every any_order group")
+    parser.add_argument("--optional-rate", default=0.0, type=float, help="Chance of an optional call before a step")
+    parser.add_argument("--no-final-answer", action="store_true", help="Don't have the judge rule the final answers")
+    parser.add_argument("--seed", default=0, type=int, help="Seed the specs are generated from")
+    args = parser.parse_args()
+
+    generator = SpecGenerator(GeneratorConfig(
+        functions=args.functions,
+        parameters=args.parameters,
+        depth=args.depth,
+        chain_length=args.chain_length,
+        groups=args.groups,
+        group_width=args.group_width,
+        optional_rate=args.optional_rate,
+        final_answer=not args.no_final_answer,
+        seed=args.seed,
+    ))
+    paths = write_spec_files(generator.documents(args.specs), args.output_dir, args.specs_per_file, args.prefix)
+    print(f"Wrote {args.specs} specs to {len(paths)} files in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import uuid
+import yaml
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, List, Optional
+from .function_calling_test_suite import TestCase, ExpectedFunctionCall
+
+# Scripted behaviours the stand-in model can play for every spec
+CORRECT = "correct"
+WRONG_ARGUMENTS = "wrong-arguments"
+EXTRA_CALLS = "extra-calls"
+OUT_OF_ORDER = "out-of-order"
+BEHAVIORS = [CORRECT, WRONG_ARGUMENTS, EXTRA_CALLS, OUT_OF_ORDER]
+
+
+class StandInConfig:
+    def __init__(
+            self,
+            behavior: str = CORRECT,
+            time_to_first_token: float = 0.0,
+            chunk_delay: float = 0.0,
+            chunk_size: int = 8,
+            rate_limit_rate: float = 0.0,
+            error_rate: float = 0.0,
+            truncate_rate: float = 0.0,
+            tail_rate: float = 0.0,
+            tail_delay: float = 0.0,
+            retry_after: float = 1.0,
+            requests_per_minute: Optional[float] = None,
+            seed: Optional[int] = None,
+    ):
+        self.behavior = behavior
+        self.time_to_first_token = time_to_first_token
+        self.chunk_delay = chunk_delay
+        self.chunk_size = max(1, chunk_size)
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.tail_rate = tail_rate
+        self.tail_delay = tail_delay
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.random = random.Random(seed)
+
+
+class StandInModel:
+    """
+    Plays back scripted tool calls for the specs in a spec directory, identifying the spec by its prompt.
+    """
+
+    def __init__(self, spec_dir: str, config: StandInConfig):
+        self.config = config
+        self.test_cases: Dict[str, TestCase] = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0, "truncated": 0, "slowed": 0}
+        self.level = config.requests_per_minute or 0.0
+        self.updated = time.monotonic()
+
+        for spec_file in sorted(os.listdir(spec_dir)):
+            if not (spec_file.endswith(".yaml") or spec_file.endswith(".yml")):
+                continue
+
+            with open(os.path.join(spec_dir, spec_file), "r") as file:
+                for document in yaml.safe_load_all(file):
+                    test_case = TestCase.parse_yaml(document)
+                    self.test_cases.setdefault(test_case.prompt, test_case)
+
+    def admit(self) -> Optional[Dict[str, str]]:
+        # Returns the headers of a 429 response when the request should be rate limited
+        with self.lock:
+            self.stats["requests"] += 1
+            headers = None
+            if self.config.requests_per_minute:
+                now = time.monotonic()
+                rpm = self.config.requests_per_minute
+                self.level = min(rpm, self.level + (now - self.updated) * rpm / 60)
+                self.updated = now
+                if self.level < 1:
+                    headers = {
+                        "retry-after": f"{(1 - self.level) * 60 / rpm:.3f}",
+                        "x-ratelimit-limit-requests": str(int(rpm)),
+                        "x-ratelimit-remaining-requests": "0",
+                    }
+                else:
+                    self.level -= 1
+
+            if headers is None and self.config.random.random() < self.config.rate_limit_rate:
+                headers = {"retry-after": str(self.config.retry_after)}
+
+            if headers is not None:
+                self.stats["rate_limited"] += 1
+            return headers
+
+    def fail(self) -> bool:
+        return self.inject("errors", self.config.error_rate)
+
+    def inject(self, fault: str, rate: float) -> bool:
+        with self.lock:
+            injected = self.config.random.random() < rate
+            if injected:
+                self.stats[fault] += 1
+            return injected
+
+    def rate_limit_headers(self) -> Dict[str, str]:
+        if not self.config.requests_per_minute:
+            return {}
+
+        with self.lock:
+            return {
+                "x-ratelimit-limit-requests": str(int(self.config.requests_per_minute)),
+                "x-ratelimit-remaining-requests": str(int(self.level)),
+            }
+
+    def respond(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        messages = request.get("messages", [])
+        if request.get("response_format", {}).get("type") == "json_object":
+            return self.judge(messages)
+
+        prompt = next((m.get("content") for m in messages if m.get("role") == "user"), "")
+        test_case = self.test_cases.get(prompt)
+        if test_case is None:
+            return {"role": "assistant", "content": "I don't know how to help with that."}
+
+        turns = self.script(test_case)
+        completed = len([m for m in messages if m.get("role") == "tool"])
+        for turn in turns:
+            if completed < len(turn):
+                return {
+                    "role": "assistant",
+                    "tool_calls": [
+                        {
+                            "id": f"call_{uuid.uuid4().hex[:24]}",
+                            "type": "function",
+                            "function": {
+                                "name": call.name,
+                                "arguments": json.dumps(call.arguments),
+                            },
+                        }
+                        for call in turn
+                    ],
+                }
+            completed -= len(turn)
+
+        results = [m.get("content") or "" for m in messages if m.get("role") == "tool"]
+        return {"role": "assistant", "content": "The results are: " + "; ".join(results)}
+
+    def script(self, test_case: TestCase) -> List[List[ExpectedFunctionCall]]:
+        behavior = self.config.behavior
+        turns = []
+        for call in test_case.expected_function_calls:
+            if hasattr(call, "any_order"):
+                group = [c for c in call.any_order if not c.optional]
+                if behavior == OUT_OF_ORDER:
+                    group.reverse()
+                if group:
+                    turns.append(group)
+            elif not call.optional:
+                turns.append([call])
+
+        if behavior == WRONG_ARGUMENTS and turns:
+            first = turns[0][0]
+            turns[0] = [ExpectedFunctionCall(name=first.name, arguments={"unexpected": True})] + turns[0][1:]
+        elif behavior == EXTRA_CALLS and test_case.available_functions:
+            extra = test_case.available_functions[0]
+            turns.append([ExpectedFunctionCall(name=extra.name, arguments={})])
+
+        return turns
+
+    def judge(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        ruling = {"correct": True, "reasoning": "Ruled correct by the stand-in judge."}
+        judged = json.loads(messages[-1].get("content") or "{}")
+        if "answers" in judged:
+            content = {"rulings": [ruling for _ in judged["answers"]]}
+        else:
+            content = ruling
+        return {"role": "assistant", "content": json.dumps(content)}
+
+
+def chunked(value: str, size: int) -> List[str]:
+    return [value[i:i + size] for i in range(0, len(value), size)] or [""]
+
+
+def new_handler(stand_in: StandInModel):
+    config = stand_in.config
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self.send_json(200, {"object": "list", "data": [{"id": "stand-in", "object": "model"}]})
+            elif self.path.rstrip("/").endswith("/stats"):
+                self.send_json(200, stand_in.stats)
+            else:
+                self.send_json(404, {"error": {"message": "Not found"}})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": "Not found"}})
+                return
+
+            rate_limit_headers = stand_in.admit()
+            if rate_limit_headers is not None:
+                self.send_json(429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}}, rate_limit_headers)
+                return
+
+            if stand_in.fail():
+                self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                return
+
+            message = stand_in.respond(request)
+            finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+            model = request.get("model") or "stand-in"
+            prompt_tokens = len(json.dumps(request.get("messages", []))) // 4
+            completion_tokens = len(json.dumps(message)) // 4
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+
+            deltas = self.deltas(message)
+            time.sleep(config.time_to_first_token)
+            if stand_in.inject("slowed", config.tail_rate):
+                time.sleep(config.tail_delay)
+            if not request.get("stream"):
+                time.sleep(config.chunk_delay * (len(deltas) - 1))
+                self.send_json(200, {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                    "usage": usage,
+                }, stand_in.rate_limit_headers())
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            for name, value in stand_in.rate_limit_headers().items():
+                self.send_header(name, value)
+            self.end_headers()
+
+            def chunk(choices: List[Dict[str, Any]], **extra) -> Dict[str, Any]:
+                return {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": choices,
+                    **extra,
+                }
+
+            truncate = stand_in.inject("truncated", config.truncate_rate)
+            for index, delta in enumerate(deltas):
+                if index > 0:
+                    time.sleep(config.chunk_delay)
+                self.send_event(chunk([{"index": 0, "delta": delta, "finish_reason": None}]))
+                if truncate:
+                    # Drop the connection in the middle of the response body
+                    self.close_connection = True
+                    return
+
+            self.send_event(chunk([{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self.send_event(chunk([], usage=usage))
+            self.send_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def deltas(self, message: Dict[str, Any]) -> List[Dict[str, Any]]:
+            deltas = []
+            for part in chunked(message.get("content") or "", config.chunk_size) if message.get("content") else []:
+                deltas.append({"content": part})
+
+            for index, tool_call in enumerate(message.get("tool_calls") or []):
+                for part_index, part in enumerate(chunked(tool_call["function"]["arguments"], config.chunk_size)):
+                    delta = {"index": index, "function": {"arguments": part}}
+                    if part_index == 0:
+                        delta.update(id=tool_call["id"], type="function")
+                        delta["function"]["name"] = tool_call["function"]["name"]
+                    deltas.append({"tool_calls": [delta]})
+
+            if not deltas:
+                deltas.append({"content": ""})
+            deltas[0]["role"] = "assistant"
+            return deltas
+
+        def send_event(self, data: Dict[str, Any] | str):
+            payload = data if isinstance(data, str) else json.dumps(data)
+            event = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve(host: str, port: int, spec_dir: str, config: StandInConfig) -> StandInServer:
+    return StandInServer((host, port), new_handler(StandInModel(spec_dir, config)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in model for exercising the suite")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", default=8080, type=int, help="Port to listen on")
+    parser.add_argument("--spec-dir", default="specs", help="Directory containing the YAML test spec files to play back")
+    parser.add_argument("--behavior", default=CORRECT, choices=BEHAVIORS, help="Scripted tool call behaviour")
+    parser.add_argument("--ttft", default=0.0, type=float, help="Time to first token in seconds")
+    parser.add_argument("--chunk-delay", default=0.0, type=float, help="Delay in seconds between streamed chunks")
+    parser.add_argument("--chunk-size", default=8, type=int, help="Characters of content or arguments per streamed chunk")
+    parser.add_argument("--rate-limit-rate", default=0.0, type=float, help="Fraction of requests answered with a 429")
+    parser.add_argument("--error-rate", default=0.0, type=float, help="Fraction of requests answered with a 500")
+    parser.add_argument("--truncate-rate", default=0.0, type=float, help="Fraction of streams cut off after the first chunk")
+    parser.add_argument("--tail-rate", default=0.0, type=float, help="Fraction of requests delayed by --tail-delay")
+    parser.add_argument("--tail-delay", default=0.0, type=float, help="Extra seconds before the first token of slowed requests")
+    parser.add_argument("--retry-after", default=1.0, type=float, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--rpm", default=None, type=float, help="Requests per minute enforced with x-ratelimit-* headers")
+    parser.add_argument("--seed", default=None, type=int, help="Seed for fault injection")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.spec_dir, StandInConfig(
+        behavior=args.behavior,
+        time_to_first_token=args.ttft,
+        chunk_delay=args.chunk_delay,
+        chunk_size=args.chunk_size,
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        truncate_rate=args.truncate_rate,
+        tail_rate=args.tail_rate,
+        tail_delay=args.tail_delay,
+        retry_after=args.retry_after,
+        requests_per_minute=args.rpm,
+        seed=args.seed,
+    ))
+    # Print the address first so scripts can read it the same way test.sh reads gptscript daemon addresses
+    print(f"http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
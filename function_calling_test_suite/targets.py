@@ -0,0 +1,53 @@
+import os
+from typing import List, Optional
+import yaml
+from pydantic import BaseModel, model_validator
+
+
+class Target(BaseModel):
+    """
+    A model to run the specs against, and the endpoint serving it.
+
+    name identifies the target's results and defaults to model. api_key_env names an environment variable to read the
+    API key from, so target files don't need to contain keys. concurrency, rpm and tpm override --concurrency,
+    --model-rpm and --model-tpm for the target.
+    """
+
+    model: Optional[str] = None
+    name: Optional[str] = None
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    api_key_env: Optional[str] = None
+    concurrency: Optional[int] = None
+    rpm: Optional[float] = None
+    tpm: Optional[float] = None
+
+    @model_validator(mode="after")
+    def default_name(self):
+        if self.name is None:
+            self.name = self.model
+        return self
+
+    def resolve_api_key(self) -> Optional[str]:
+        if self.api_key is None and self.api_key_env is not None:
+            return os.getenv(self.api_key_env)
+        return self.api_key
+
+
+def environment_target() -> Target:
+    return Target(model=os.getenv("FCTS_MODEL"), base_url=os.getenv("FCTS_BASE_URL"), api_key=os.getenv("FCTS_API_KEY"))
+
+
+def load_targets(path: str) -> List[Target]:
+    with open(path, "r") as file:
+        targets = [Target(**target) for target in yaml.safe_load(file) or []]
+
+    if not targets:
+        raise ValueError(f"No targets found in {path}")
+
+    names = [target.name for target in targets]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Targets must have unique names, found duplicates: {', '.join(map(str, duplicates))}")
+
+    return targets
@@ -0,0 +1,198 @@
+import asyncio
+import contextlib
+import json
+import os
+import secrets
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Generator, Iterator, List, Optional
+
+CHROME = "chrome"
+OTLP = "otlp"
+FORMATS = [CHROME, OTLP]
+
+SERVICE_NAME = "function-calling-test-suite"
+
+# The attributes of the spec run that the code in the current context works for, added to every span it starts
+ATTRIBUTES: ContextVar[Dict[str, Any]] = ContextVar("trace_attributes", default={})
+
+# [name, start, end, process, lane, attributes], with times in nanoseconds since the epoch
+Span = List[Any]
+
+
+class Tracer:
+    """
+    Records timed spans of the phases of a session, to be written as a Chrome trace or an OTLP JSON file.
+
+    Spans are laid out in lanes: every asyncio task, or thread outside of a task, gets its own, so the spans of
+    concurrent conversations don't overlap in a trace viewer. Spans of pytest-xdist workers are merged into the
+    controller's tracer with the worker as their process.
+    """
+
+    def __init__(self, process: str = "main"):
+        self.process = process
+        self.spans: List[Span] = []
+        self.lanes: Dict[int, int] = {}
+        self.lock = threading.Lock()
+        # Wall clock time of the monotonic clock's zero, so span times are comparable across processes
+        self.epoch = time.time_ns() - time.perf_counter_ns()
+
+    @contextlib.contextmanager
+    def span(self, name: str, attributes: Dict[str, Any]) -> Iterator[None]:
+        lane = self.lane()
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            with self.lock:
+                self.spans.append([name, self.epoch + start, self.epoch + end, self.process, lane, attributes])
+
+    def lane(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = id(task) if task is not None else threading.get_ident()
+        with self.lock:
+            return self.lanes.setdefault(key, len(self.lanes) + 1)
+
+    def merge(self, spans: List[Span]):
+        with self.lock:
+            self.spans.extend(spans)
+
+    def write(self, path: str, trace_format: str = CHROME):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span[1])
+        document = chrome_trace(spans) if trace_format == CHROME else otlp_trace(spans)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(document, file, default=str)
+        os.replace(temporary_path, path)
+
+
+def chrome_trace(spans: List[Span]) -> Dict[str, Any]:
+    # Complete events of the Trace Event Format, with times in microseconds, as chrome://tracing and Perfetto read it
+    processes = {process: number for number, process in enumerate(dict.fromkeys(span[3] for span in spans), 1)}
+    events = [
+        {"name": "process_name", "ph": "M", "pid": number, "tid": 0, "args": {"name": process}}
+        for process, number in processes.items()
+    ]
+    events += [
+        {
+            "name": name,
+            "cat": SERVICE_NAME,
+            "ph": "X",
+            "ts": start / 1000,
+            "dur": (end - start) / 1000,
+            "pid": processes[process],
+            "tid": lane,
+            "args": attributes,
+        }
+        for name, start, end, process, lane, attributes in spans
+    ]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def otlp_trace(spans: List[Span]) -> Dict[str, Any]:
+    # The OTLP JSON encoding of ExportTraceServiceRequest, as the OpenTelemetry collector's file exporter writes it.
+    # Every span is a child of a root span covering the whole session.
+    trace_id = secrets.token_hex(16)
+    root_id = secrets.token_hex(8)
+    otlp_spans = []
+    if spans:
+        otlp_spans.append({
+            "traceId": trace_id,
+            "spanId": root_id,
+            "name": "session",
+            "kind": 1,
+            "startTimeUnixNano": str(min(span[1] for span in spans)),
+            "endTimeUnixNano": str(max(span[2] for span in spans)),
+            "attributes": [],
+        })
+    for name, start, end, process, lane, attributes in spans:
+        otlp_spans.append({
+            "traceId": trace_id,
+            "spanId": secrets.token_hex(8),
+            "parentSpanId": root_id,
+            "name": name,
+            "kind": 1,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(end),
+            "attributes": otlp_attributes({**attributes, "process": process, "lane": lane}),
+        })
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "function_calling_test_suite"}, "spans": otlp_spans}],
+        }],
+    }
+
+
+def otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    values = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            values.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            # 64-bit integers are strings in OTLP JSON
+            values.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            values.append({"key": key, "value": {"doubleValue": value}})
+        elif value is not None:
+            values.append({"key": key, "value": {"stringValue": str(value)}})
+    return values
+
+
+_tracer: Optional[Tracer] = None
+
+
+def set_tracer(tracer: Optional[Tracer]):
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: str, **attributes) -> contextlib.AbstractContextManager:
+    # Does nothing unless a tracer was set, so instrumented code costs next to nothing without --trace
+    if _tracer is None:
+        return contextlib.nullcontext()
+    return _tracer.span(name, {**ATTRIBUTES.get(), **attributes})
+
+
+@contextlib.contextmanager
+def attributes(**values) -> Iterator[None]:
+    token = ATTRIBUTES.set(values)
+    try:
+        yield
+    finally:
+        ATTRIBUTES.reset(token)
+
+
+def with_attributes(conversation: Generator, values: Dict[str, Any]) -> Generator:
+    # Drives a conversation, setting its attributes in the context of whatever drives it before every step, so the
+    # spans of the conversation and of the requests its driver sends on its behalf carry them
+    response, error = None, None
+    while True:
+        ATTRIBUTES.set(values)
+        try:
+            turn = conversation.send(response) if error is None else conversation.throw(error)
+        except StopIteration:
+            return
+
+        response, error = None, None
+        try:
+            response = yield turn
+        except GeneratorExit:
+            conversation.close()
+            raise
+        except BaseException as e:
+            error = e
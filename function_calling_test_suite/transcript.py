@@ -0,0 +1,127 @@
+import copy
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+
+def payload_key(payload: Any) -> str:
+    content = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def cap_responses(responses: List[Dict[str, Any]], limit: Optional[int]) -> List[Dict[str, Any]]:
+    # Keeps the last responses, which led to the run's outcome
+    if limit is None:
+        return responses
+    return responses[len(responses) - limit:] if limit > 0 else []
+
+
+def function_tools(functions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # The tools of a run's requests, which are its spec's functions
+    return [{"type": "function", "function": function} for function in functions]
+
+
+def reference_messages(
+        responses: List[Dict[str, Any]],
+        messages: List[Dict[str, Any]],
+        name: str,
+) -> List[Dict[str, Any]]:
+    # Refers to the assistant message of each response by its index in messages, named name, instead of repeating it
+    indexes = {payload_key(message): index for index, message in enumerate(messages)}
+    referenced = []
+    for response in responses:
+        choices = []
+        for choice in response.get("choices") or []:
+            index = indexes.get(payload_key(choice["message"])) if "message" in choice else None
+            choices.append(choice if index is None else {**choice, "message": {"$ref": f"{name}[{index}]"}})
+        referenced.append({**response, "choices": choices} if choices else response)
+    return referenced
+
+
+class TranscriptStore:
+    """
+    Compact store of the transcripts of every run in a session.
+
+    Each spec is stored once, including the functions that make up the tools of its requests. Messages and raw
+    responses are interned by content hash in payloads, and the assistant message of a response refers to the interned
+    message instead of repeating it. A run's messages are a single key into prefixes, where each entry is a
+    [parent, message] pair, so runs that start with the same messages share those entries.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.specs: Dict[str, Dict[str, Any]] = {}
+        self.payloads: Dict[str, Any] = {}
+        self.prefixes: Dict[str, List[Optional[str]]] = {}
+
+    def intern(self, payload: Any) -> str:
+        key = payload_key(payload)
+        self.payloads.setdefault(key, payload)
+        return key
+
+    def compact(self, spec_id: str, test_case: Dict[str, Any]) -> Dict[str, Any]:
+        # Takes a test case dumped in JSON mode and returns its actual results with references into the store
+        actual = dict(test_case.get("actual") or {})
+        actual.pop("tools", None)
+        with self.lock:
+            self.specs.setdefault(spec_id, {k: v for k, v in test_case.items() if k != "actual"})
+
+            prefix = None
+            for message in actual.get("messages") or []:
+                node = [prefix, self.intern(message)]
+                prefix = payload_key(node)
+                self.prefixes.setdefault(prefix, node)
+            actual["messages"] = prefix
+
+            actual["responses"] = [
+                self.intern(self.reference_messages(response)) for response in actual.get("responses") or []
+            ]
+
+        return {"spec_id": spec_id, "actual": actual}
+
+    def reference_messages(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        if not response.get("choices"):
+            return response
+
+        response = dict(response)
+        response["choices"] = [
+            {**choice, "message": {"$ref": self.intern(choice["message"])}} if "message" in choice else choice
+            for choice in response["choices"]
+        ]
+        return response
+
+    def expand(self, compact: Dict[str, Any]) -> Dict[str, Any]:
+        # Returns the test case dump that compact was made from, with the spec's functions as its tools
+        return expand(self.to_dict(), compact)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"specs": self.specs, "payloads": self.payloads, "prefixes": self.prefixes}
+
+
+def expand(transcripts: Dict[str, Any], compact: Dict[str, Any]) -> Dict[str, Any]:
+    # Works on the transcripts of a JSON report as well as on a TranscriptStore's
+    payloads = transcripts["payloads"]
+    test_case = copy.deepcopy(transcripts["specs"][compact["spec_id"]])
+    actual = dict(compact["actual"])
+
+    messages = []
+    prefix = actual.get("messages")
+    while prefix is not None:
+        prefix, message = transcripts["prefixes"][prefix]
+        messages.append(copy.deepcopy(payloads[message]))
+    actual["messages"] = messages[::-1]
+
+    responses = []
+    for key in actual.get("responses") or []:
+        response = copy.deepcopy(payloads[key])
+        for choice in response.get("choices") or []:
+            if "$ref" in (choice.get("message") or {}):
+                choice["message"] = copy.deepcopy(payloads[choice["message"]["$ref"]])
+        responses.append(response)
+    actual["responses"] = responses
+
+    actual["tools"] = function_tools(test_case["available_functions"])
+    test_case["actual"] = actual
+    return test_case
@@ -0,0 +1,110 @@
+import importlib.util
+import threading
+import time
+from typing import Dict, List
+import httpx
+from pydantic import BaseModel
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class TransportOptions(BaseModel):
+    pool_size: int = 100
+    keepalive_connections: int = 100
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    connect_timeout: float = 10.0
+    read_timeout: float = 300.0
+
+
+class HostStats(BaseModel):
+    requests: int = 0
+    connections: int = 0
+    connect_seconds: float = 0.0
+    http2_requests: int = 0
+
+
+class ConnectionStats:
+    """
+    Counts the requests sent to each host and the connections opened for them, so connection reuse can be reported.
+
+    New connections are detected with the trace extension of httpcore, which httpx passes its events to.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts: Dict[str, HostStats] = {}
+
+    def host(self, host: str) -> HostStats:
+        with self.lock:
+            return self.hosts.setdefault(host, HostStats())
+
+    def request_hook(self, request: httpx.Request):
+        request.extensions["trace"] = self.tracer(request)
+
+    async def async_request_hook(self, request: httpx.Request):
+        trace = self.tracer(request)
+
+        async def async_trace(name: str, info: Dict):
+            trace(name, info)
+
+        request.extensions["trace"] = async_trace
+
+    def tracer(self, request: httpx.Request):
+        stats = self.host(request.url.netloc.decode("ascii"))
+        with self.lock:
+            stats.requests += 1
+        connect_started = []
+
+        def trace(name: str, info: Dict):
+            if name == "connection.connect_tcp.started":
+                connect_started.append(time.perf_counter())
+            elif name == "connection.connect_tcp.complete" and connect_started:
+                with self.lock:
+                    stats.connections += 1
+                    stats.connect_seconds += time.perf_counter() - connect_started.pop()
+            elif name == "http2.send_request_headers.started":
+                with self.lock:
+                    stats.http2_requests += 1
+
+        return trace
+
+    def merge(self, hosts: Dict[str, Dict]):
+        # Adds the stats of another process, as returned by to_dict
+        for host, other in hosts.items():
+            stats = self.host(host)
+            with self.lock:
+                for field in HostStats.model_fields:
+                    setattr(stats, field, getattr(stats, field) + other[field])
+
+    def to_dict(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {host: stats.model_dump() for host, stats in self.hosts.items()}
+
+    def summary(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for host, stats in sorted(self.hosts.items()):
+                reused = 1 - stats.connections / stats.requests if stats.requests else 0.0
+                connect = 1000 * stats.connect_seconds / stats.connections if stats.connections else 0.0
+                lines.append(
+                    f"{host}: {stats.requests} requests over {stats.connections} new connections "
+                    f"({reused:.0%} reused, {connect:.1f} ms average connect, {stats.http2_requests} over HTTP/2)"
+                )
+        return lines
+
+
+def new_http_client(options: TransportOptions, stats: ConnectionStats, asynchronous: bool = False):
+    client_class = httpx.AsyncClient if asynchronous else httpx.Client
+    hook = stats.async_request_hook if asynchronous else stats.request_hook
+    return client_class(
+        limits=httpx.Limits(
+            max_connections=options.pool_size,
+            max_keepalive_connections=options.keepalive_connections,
+            keepalive_expiry=options.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(options.read_timeout, connect=options.connect_timeout),
+        http2=options.http2 and HTTP2_AVAILABLE,
+        follow_redirects=True,
+        event_hooks={"request": [hook]},
+    )
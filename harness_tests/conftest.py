@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+from function_calling_test_suite.stand_in_server import StandInConfig, serve
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def stand_in():
+    """
+    Starts stand-in model servers on free ports, returning a function that serves a behavior and returns its base URL.
+    """
+    servers = []
+
+    def start(behavior: str) -> str:
+        server = serve("127.0.0.1", 0, str(ROOT / "specs"), StandInConfig(behavior=behavior))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def run_suite(tmp_path):
+    """
+    Returns a function that runs the model suite against a stand-in in a subprocess and returns its JSON report.
+    """
+
+    def run(base_url: str, *args: str, model: str = "stand-in", env: dict | None = None) -> dict:
+        (tmp_path / "reports").mkdir(exist_ok=True)
+        env = dict(
+            os.environ,
+            FCTS_MODEL=model,
+            FCTS_BASE_URL=base_url,
+            FCTS_API_KEY="stand-in",
+            OPENAI_BASE_URL=base_url,
+            OPENAI_API_KEY="stand-in",
+            # So the suite can load the plugins in harness_tests with -p
+            PYTHONPATH=os.pathsep.join([str(ROOT), str(ROOT / "harness_tests")]),
+            **(env or {}),
+        )
+        command = [
+            sys.executable, "-m", "pytest", str(ROOT / "tests"), "-p", "no:randomly", "-q",
+            f"--spec-dir={ROOT / 'specs'}", *args,
+        ]
+        result = subprocess.run(command, cwd=tmp_path, env=env, capture_output=True, text=True, timeout=600)
+        report = tmp_path / "reports" / f"{model}_report.json"
+        assert report.exists(), result.stdout + result.stderr
+        return json.loads(report.read_text())
+
+    return run
+
+
+def failures(report: dict) -> dict:
+    """
+    Returns the longrepr of each failed test in a JSON report by nodeid.
+    """
+    return {
+        test["nodeid"]: test["call"]["longrepr"]
+        for test in report["tests"]
+        if test["outcome"] == "failed" and "call" in test
+    }
@@ -0,0 +1,39 @@
+"""
+A plugin for the model suite that writes the largest number of runs whose state was alive at once to the file in
+FCTS_LIVE_RUNS_FILE when the session ends.
+"""
+import gc
+import os
+import weakref
+
+from function_calling_test_suite import TestCase
+
+new_run = TestCase.new_run
+live = 0
+peak = 0
+
+
+def released():
+    global live
+    live -= 1
+
+
+def tracked_new_run(self) -> TestCase:
+    global live, peak
+    run = new_run(self)
+    live += 1
+    weakref.finalize(run, released)
+    # Runs that are only kept alive by reference cycles don't count
+    gc.collect()
+    peak = max(peak, live)
+    return run
+
+
+def pytest_configure(config):
+    TestCase.new_run = tracked_new_run
+
+
+def pytest_unconfigure(config):
+    TestCase.new_run = new_run
+    with open(os.environ["FCTS_LIVE_RUNS_FILE"], "w") as file:
+        file.write(str(peak))
@@ -0,0 +1,16 @@
+import pytest
+
+from function_calling_test_suite.stand_in_server import CORRECT, EXTRA_CALLS
+
+
+@pytest.mark.parametrize("behavior", [CORRECT, EXTRA_CALLS])
+def test_concurrent_runs_release_their_state(stand_in, run_suite, tmp_path, behavior):
+    live_runs = tmp_path / "live_runs"
+    report = run_suite(
+        stand_in(behavior), "--spec-run-count=4", "--concurrency=4", "-p", "live_runs",
+        env={"FCTS_LIVE_RUNS_FILE": str(live_runs)},
+    )
+
+    assert report["summary"]["total"] > 4 * 4
+    # The conversations in progress, and the run being reported
+    assert int(live_runs.read_text()) <= 4 + 1
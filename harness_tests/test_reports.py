@@ -0,0 +1,26 @@
+from function_calling_test_suite.stand_in_server import EXTRA_CALLS, WRONG_ARGUMENTS
+
+from conftest import failures
+
+
+def test_failed_checks_show_values(stand_in, run_suite):
+    report = run_suite(stand_in(EXTRA_CALLS), "--spec-filter=01_*")
+
+    longreprs = failures(report)
+    assert longreprs
+    for longrepr in longreprs.values():
+        assert "function_calling_test_suite/conversation.py" in longrepr
+        assert "more tool calls than expected\nE   assert 1 <= 0\nE    +  where 1 = len(" in longrepr
+
+
+def test_failed_matches_show_values(stand_in, run_suite):
+    report = run_suite(stand_in(WRONG_ARGUMENTS), "--spec-filter=0[35]_*")
+
+    longreprs = failures(report).values()
+    assert longreprs
+    for longrepr in longreprs:
+        assert "function_calling_test_suite/matching.py" in longrepr
+    # Sequences compare the arguments, any_order groups look the call up
+    assert any("assert {'unexpected': True} == {" in longrepr for longrepr in longreprs)
+    assert any("Tool call not found in expected call group\nE   assert None is not None" in longrepr
+               for longrepr in longreprs)
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+import yaml
+from openai.types.chat import ChatCompletionChunk
+
+from function_calling_test_suite import TestCase
+from function_calling_test_suite.conversation import converse, to_chat_completion
+from function_calling_test_suite.stand_in_server import EXTRA_CALLS
+
+from conftest import ROOT, failures
+
+
+def basic_spec() -> TestCase:
+    with open(ROOT / "specs" / "01_basic.yaml") as file:
+        return TestCase.parse_yaml(next(yaml.safe_load_all(file)))
+
+
+def chunk(delta: dict, finish_reason: str | None = None) -> ChatCompletionChunk:
+    return ChatCompletionChunk.model_validate({
+        "id": "chunk", "object": "chat.completion.chunk", "created": 0, "model": "stand-in",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    })
+
+
+def tool_call_chunks(calls: list) -> list:
+    # Streams each call's name first and then its arguments in pieces, as providers do
+    chunks = []
+    for index, (name, arguments) in enumerate(calls):
+        function = {"name": name, "arguments": ""}
+        chunks.append(chunk({"role": "assistant", "tool_calls": [
+            {"index": index, "id": f"call_{index}", "type": "function", "function": function},
+        ]}))
+        arguments = json.dumps(arguments)
+        for start in range(0, len(arguments), 4):
+            function = {"arguments": arguments[start:start + 4]}
+            chunks.append(chunk({"tool_calls": [{"index": index, "function": function}]}))
+    return chunks + [chunk({}, "tool_calls")]
+
+
+def failure_message(calls: list, fail_fast: bool) -> str:
+    conversation = converse(basic_spec(), "stand-in", stream=True, use_system_prompt=False, fail_fast=fail_fast)
+    _, _, _, stream_check = next(conversation)
+    with pytest.raises(AssertionError) as error:
+        conversation.send(to_chat_completion(iter(tool_call_chunks(calls)), stream_check))
+    return str(error.value)
+
+
+@pytest.mark.parametrize("calls", [
+    [("funcA", {"param1": 1}), ("funcA", {"param1": 1})],
+    [("funcA", {"param1": 2}), ("funcA", {"param1": 1})],
+    [("funcB", {}), ("funcA", {"param1": 1})],
+], ids=["extra-call", "wrong-arguments-and-extra-call", "wrong-name-and-extra-call"])
+def test_fail_fast_reports_the_same_failure(calls):
+    message = failure_message(calls, fail_fast=True)
+
+    assert "more tool calls than expected" in message
+    assert message == failure_message(calls, fail_fast=False)
+
+
+def test_fail_fast_reports_the_same_failures_against_a_stand_in(stand_in, run_suite):
+    base_url = stand_in(EXTRA_CALLS)
+
+    checked = failures(run_suite(base_url, "--stream=true", model="checked"))
+    fail_fast = failures(run_suite(base_url, "--stream=true", "--fail-fast-stream", model="fail-fast"))
+
+    assert checked
+    assert [longrepr.splitlines()[-1] for longrepr in fail_fast.values()] \
+           == [longrepr.splitlines()[-1] for longrepr in checked.values()]
@@ -26,6 +26,18 @@ run_suite() {
   }
 }
 
+run_stand_in() {
+  # Server options (e.g. --behavior, --ttft, --error-rate) are read from FCTS_STAND_IN_ARGS.
+  poetry run fcts-stand-in --port 0 ${FCTS_STAND_IN_ARGS} | {
+    trap cleanup EXIT
+    read LINE
+    export FCTS_BASE_URL="${LINE}/v1" FCTS_MODEL='stand-in' FCTS_API_KEY='foo'
+    export OPENAI_BASE_URL="${LINE}/v1" OPENAI_API_KEY='foo'
+    poetry run pytest --cache-clear -s "$@" && echo "stand-in FCTS test complete"
+    exit
+  }
+}
+
 setup_gemini() {
   if ! gcloud config list 2>/dev/null | grep -qE 'quota_project|account|project'; then
     cat <<EOF
@@ -66,8 +78,9 @@ gemini-1.5-pro)
   run_suite github.com/gptscript-ai/gemini-vertexai-provider gemini-1.5-pro "${@:2}"
   ;;
 claude-3.5-sonnet) run_suite github.com/gptscript-ai/claude3-anthropic-provider claude-3-5-sonnet-20240620 "${@:2}" ;;
+stand-in) run_stand_in "${@:2}" ;;
 *)
-  echo "Usage: $0 {clear|mistral-large-latest|gemini-1.5-pro|claude-3.5-sonnet} [PYTEST_OPTIONS]"
+  echo "Usage: $0 {clear|mistral-large-latest|gemini-1.5-pro|claude-3.5-sonnet|stand-in} [PYTEST_OPTIONS]"
   exit 1
   ;;
 esac
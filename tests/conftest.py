@@ -1,12 +1,30 @@
 import os
+import asyncio
 import pytest
 import json
-import fnmatch
-import csv
-import re
-import yaml
-from openai import OpenAI
-from function_calling_test_suite import TestCase
+import httpx
+from typing import Generator
+from openai import OpenAI, AsyncOpenAI
+
+# The conversation checks moved out of test_model.py, and are rewritten like its asserts were, so failures still show
+# the compared values. Registered before anything imports them.
+pytest.register_assert_rewrite("function_calling_test_suite.conversation", "function_calling_test_suite.matching")
+
+from function_calling_test_suite import Actual, TestCase
+from function_calling_test_suite.cassette import Cassette, CassetteClient
+from function_calling_test_suite.conversation import ConversationSkipped, converse, run_conversations_async
+from function_calling_test_suite.journal import Journal, JournalLocked, JournalMismatch
+from function_calling_test_suite.judge_cache import JudgeCache
+from function_calling_test_suite.rate_limit import RateLimiter
+from function_calling_test_suite.report_writer import ReportWriter
+from function_calling_test_suite.results_store import ResultsStore
+from function_calling_test_suite.retry import InfrastructureError, RetryPolicy
+from function_calling_test_suite.sampling import METHODS, AdaptiveSampler
+from function_calling_test_suite.spec_cache import SpecCache, load_test_cases
+from function_calling_test_suite import tracing
+from function_calling_test_suite.targets import Target, environment_target, load_targets
+from function_calling_test_suite.transcript import TranscriptStore, cap_responses, function_tools, reference_messages
+from function_calling_test_suite.transport import HTTP2_AVAILABLE, ConnectionStats, TransportOptions, new_http_client
 
 
 def pytest_addoption(parser):
@@ -17,6 +35,35 @@ def pytest_addoption(parser):
         type=int,
         help="Number of times each test spec should be run",
     )
+    parser.addoption(
+        "--adaptive-sampling",
+        action="store",
+        default=None,
+        choices=METHODS,
+        help="Stop running a spec before --spec-run-count once its pass rate is known well enough (wilson or sprt). "
+             "Skipped runs aren't given to other specs",
+    )
+    parser.addoption(
+        "--adaptive-width",
+        action="store",
+        default=0.3,
+        type=float,
+        help="Pass rate interval width at which adaptive sampling stops (the indifference region for sprt)",
+    )
+    parser.addoption(
+        "--adaptive-threshold",
+        action="store",
+        default=0.5,
+        type=float,
+        help="Pass rate that sprt adaptive sampling decides a spec is above or below",
+    )
+    parser.addoption(
+        "--adaptive-confidence",
+        action="store",
+        default=0.95,
+        type=float,
+        help="Confidence level of adaptive sampling decisions and of the pass rate intervals in the aggregate CSV",
+    )
     parser.addoption(
         "--spec-filter",
         action="store",
@@ -29,6 +76,12 @@ def pytest_addoption(parser):
         default="specs",
         help="Directory containing JSON test spec files",
     )
+    parser.addoption(
+        "--spec-cache",
+        action="store",
+        default=None,
+        help="Directory to cache parsed test specs in between runs (disabled when unset)",
+    )
     parser.addoption(
         "--stream",
         action="store",
@@ -47,116 +100,912 @@ def pytest_addoption(parser):
         default="reports/aggregate_summary.csv",
         help="Add results for the model to an aggregate CSV file",
     )
+    parser.addoption(
+        "--aggregate-latency-file",
+        action="store",
+        default="reports/aggregate_latency.csv",
+        help="Add latency percentiles and throughput for the model to an aggregate CSV file",
+    )
+    parser.addoption(
+        "--summary-latency",
+        action="store_true",
+        help="Add latency percentiles and throughput for every spec to the --aggregate-summary-file",
+    )
+    parser.addoption(
+        "--results-db",
+        action="store",
+        default="reports/results.db",
+        help="SQLite database that every run is recorded in and the aggregate CSV files are exported from",
+    )
+    parser.addoption(
+        "--jsonl-report",
+        action="store",
+        default=None,
+        help="File to append one JSON line per finished test to, gzipped when it ends in .gz (disabled when unset)",
+    )
+    parser.addoption(
+        "--max-passing-responses",
+        action="store",
+        default=None,
+        type=int,
+        help="Number of raw responses, the last ones, kept in the reports of passing tests (0 drops them)",
+    )
+    parser.addoption(
+        "--journal",
+        action="store",
+        default="reports/journal.jsonl",
+        help="File that every completed spec run is written to as soon as it's reported, for --resume",
+    )
+    parser.addoption(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Skip the spec runs already completed in --journal and report them together with the new runs",
+    )
     parser.addoption(
         "--request-delay",
         action="store",
         default=0.0,
-        help="Delay in seconds between chat completion requests",
+        help="Delay in seconds between model chat completion requests (shorthand for --model-rpm=60/REQUEST_DELAY)",
+    )
+    parser.addoption(
+        "--model-rpm",
+        action="store",
+        default=None,
+        type=float,
+        help="Requests per minute budget for the model client (adapts to rate limit headers when unset)",
+    )
+    parser.addoption(
+        "--model-tpm",
+        action="store",
+        default=None,
+        type=float,
+        help="Tokens per minute budget for the model client (adapts to rate limit headers when unset)",
+    )
+    parser.addoption(
+        "--judge-rpm",
+        action="store",
+        default=None,
+        type=float,
+        help="Requests per minute budget for the judge client (adapts to rate limit headers when unset)",
+    )
+    parser.addoption(
+        "--judge-tpm",
+        action="store",
+        default=None,
+        type=float,
+        help="Tokens per minute budget for the judge client (adapts to rate limit headers when unset)",
+    )
+    parser.addoption(
+        "--judge-cache",
+        action="store",
+        default=None,
+        help="Path to an on-disk cache of judge rulings that is reused across runs (disabled when unset)",
+    )
+    parser.addoption(
+        "--judge-cache-size",
+        action="store",
+        default=10000,
+        type=int,
+        help="Maximum number of judge rulings kept in the judge cache before the least recently used are evicted",
+    )
+    parser.addoption(
+        "--defer-judging",
+        action="store_true",
+        default=False,
+        help="Queue final answers and judge them in a separate stage after all tool calls have been checked",
+    )
+    parser.addoption(
+        "--judge-batch-size",
+        action="store",
+        default=1,
+        type=int,
+        help="Number of deferred final answers packed into each judge request (batched rulings aren't cached)",
+    )
+    parser.addoption(
+        "--record",
+        action="store",
+        default=None,
+        help="Directory to record model and judge chat completion responses to",
+    )
+    parser.addoption(
+        "--replay",
+        action="store",
+        default=None,
+        help="Directory to replay recorded model and judge chat completion responses from instead of calling the APIs",
+    )
+    parser.addoption(
+        "--concurrency",
+        action="store",
+        default=1,
+        type=int,
+        help="Maximum number of spec runs executed concurrently (values above 1 enable the asyncio engine)",
+    )
+    parser.addoption(
+        "--http-pool-size",
+        action="store",
+        default=100,
+        type=int,
+        help="Maximum number of HTTP connections shared by the model and judge clients",
+    )
+    parser.addoption(
+        "--http-keepalive-connections",
+        action="store",
+        default=100,
+        type=int,
+        help="Maximum number of idle HTTP connections kept alive for reuse",
+    )
+    parser.addoption(
+        "--http-keepalive-expiry",
+        action="store",
+        default=30.0,
+        type=float,
+        help="Seconds an idle HTTP connection is kept alive for",
     )
+    parser.addoption(
+        "--http2",
+        action="store_true",
+        default=False,
+        help="Use HTTP/2 for servers that support it (requires the h2 package)",
+    )
+    parser.addoption(
+        "--connect-timeout",
+        action="store",
+        default=10.0,
+        type=float,
+        help="Seconds to wait for an HTTP connection to be established",
+    )
+    parser.addoption(
+        "--read-timeout",
+        action="store",
+        default=300.0,
+        type=float,
+        help="Seconds to wait for each read of an HTTP response (and for a connection from the pool)",
+    )
+    parser.addoption(
+        "--max-retries",
+        action="store",
+        default=3,
+        type=int,
+        help="Retries of a chat completion that failed with a connection error, 5xx response or truncated stream",
+    )
+    parser.addoption(
+        "--retry-base-delay",
+        action="store",
+        default=1.0,
+        type=float,
+        help="Seconds of backoff before the first retry, doubled for every further retry and jittered",
+    )
+    parser.addoption(
+        "--retry-max-delay",
+        action="store",
+        default=30.0,
+        type=float,
+        help="Maximum seconds of backoff before a retry",
+    )
+    parser.addoption(
+        "--hedge-percentile",
+        action="store",
+        default=None,
+        type=float,
+        help="Duplicate requests slower than this percentile of recent latencies (disabled when unset)",
+    )
+    parser.addoption(
+        "--targets",
+        action="store",
+        default=None,
+        help="YAML file listing the models to run every spec against in one session (FCTS_MODEL when unset)",
+    )
+    parser.addoption(
+        "--fail-fast-stream",
+        action="store_true",
+        default=False,
+        help="Close streamed model responses and fail as soon as they have more tool calls than expected",
+    )
+    parser.addoption(
+        "--stream-usage",
+        action="store_true",
+        default=False,
+        help="Request token usage in streamed responses (stream_options.include_usage)",
+    )
+    parser.addoption(
+        "--trace-file",
+        action="store",
+        default=None,
+        help="File to write a trace of the session's phases to, for chrome://tracing, Perfetto or OTLP tools",
+    )
+    parser.addoption(
+        "--trace-format",
+        action="store",
+        default=tracing.CHROME,
+        choices=tracing.FORMATS,
+        help="Format of the --trace-file: a Chrome trace or OTLP JSON",
+    )
+
+
+def pytest_configure(config):
+    targets_path = config.getoption("--targets")
+    try:
+        config.targets = load_targets(targets_path) if targets_path else [environment_target()]
+    except (OSError, ValueError) as e:
+        raise pytest.UsageError(f"Invalid --targets file: {e}")
+
+    if is_xdist_controller(config) and uses_asyncio_engine(config):
+        raise pytest.UsageError(
+            "--concurrency, --defer-judging and --hedge-percentile can't be used with pytest-xdist workers"
+        )
+
+    try:
+        config.journal = open_journal(config)
+    except JournalMismatch as e:
+        raise pytest.UsageError(f"Can't --resume: {e}")
+
+    # Completed runs from the journal that this session doesn't run again
+    config.resumed = {}
+    config.run_results = {}
+    config.transcripts = None if is_xdist_worker(config) else TranscriptStore()
+    config.pluginmanager.register(RunResultCollector(config), "fcts-run-results")
+
+    jsonl_report_path = config.getoption("--jsonl-report")
+    config.report_writer = None
+    if jsonl_report_path and not is_xdist_worker(config):
+        config.report_writer = ReportWriter(jsonl_report_path, append=config.getoption("--resume"))
+        config.pluginmanager.register(JsonlReporter(config.report_writer), "fcts-jsonl-report")
+
+    judge_cache_path = config.getoption("--judge-cache")
+    config.judge_cache = JudgeCache(judge_cache_path, config.getoption("--judge-cache-size")) \
+        if judge_cache_path else None
+
+    record_dir = config.getoption("--record")
+    replay_dir = config.getoption("--replay")
+    if record_dir and replay_dir:
+        raise pytest.UsageError("--record and --replay can't be used together")
+
+    config.cassette = None
+    if record_dir or replay_dir:
+        # xdist workers record to the same cassette, so its index is rebuilt from the shared file when closed
+        config.cassette = Cassette(
+            record_dir or replay_dir,
+            replay=bool(replay_dir),
+            shared=is_xdist_worker(config) or is_xdist_controller(config),
+        )
+
+    config.transport_options = TransportOptions(
+        pool_size=config.getoption("--http-pool-size"),
+        keepalive_connections=config.getoption("--http-keepalive-connections"),
+        keepalive_expiry=config.getoption("--http-keepalive-expiry"),
+        http2=config.getoption("--http2"),
+        connect_timeout=config.getoption("--connect-timeout"),
+        read_timeout=config.getoption("--read-timeout"),
+    )
+    config.connection_stats = ConnectionStats()
+    config.http_client = None
+    config.retry_policies = {}
+
+    spec_cache_dir = config.getoption("--spec-cache")
+    config.spec_cache = SpecCache(spec_cache_dir) if spec_cache_dir else None
+
+    adaptive_sampling = config.getoption("--adaptive-sampling")
+    config.sampler = AdaptiveSampler(
+        adaptive_sampling,
+        config.getoption("--adaptive-width"),
+        config.getoption("--adaptive-threshold"),
+        config.getoption("--adaptive-confidence"),
+    ) if adaptive_sampling else None
+
+    config.tracer = None
+    if config.getoption("--trace-file"):
+        config.tracer = tracing.Tracer(config.workerinput["workerid"] if is_xdist_worker(config) else "main")
+        tracing.set_tracer(config.tracer)
+
+
+def pytest_unconfigure(config):
+    if getattr(config, "journal", None) is not None:
+        config.journal.close()
+
+    if getattr(config, "report_writer", None) is not None:
+        config.report_writer.close()
+
+    if getattr(config, "judge_cache", None) is not None:
+        config.judge_cache.close()
+
+    if getattr(config, "cassette", None) is not None:
+        config.cassette.close()
+
+    if getattr(config, "spec_cache", None) is not None:
+        config.spec_cache.close()
+
+    if getattr(config, "http_client", None) is not None:
+        config.http_client.close()
+
+    if getattr(config, "tracer", None) is not None:
+        tracing.set_tracer(None)
+
+
+def open_journal(config) -> Journal:
+    path = config.getoption("--journal")
+    resume = config.getoption("--resume")
+    try:
+        return Journal(path, journal_options(config), resume=resume, writable=not is_xdist_worker(config))
+    except JournalLocked as e:
+        if resume:
+            raise pytest.UsageError(f"Can't --resume: {e}")
+
+    # Another session is writing the journal, so this one gets a journal of its own next to it
+    root, extension = os.path.splitext(path)
+    return Journal(f"{root}-{os.getpid()}{extension}", journal_options(config))
+
+
+def is_xdist_worker(config) -> bool:
+    return hasattr(config, "workerinput")
+
+
+def is_xdist_controller(config) -> bool:
+    return (
+        not is_xdist_worker(config)
+        and bool(config.getoption("numprocesses", None))
+        and config.getoption("dist", "no") != "no"
+    )
+
+
+def worker_share(config, budget: float | None) -> float | None:
+    # Every xdist worker has its own rate limiters, so each gets an equal share of a configured budget
+    if budget is None or not is_xdist_worker(config):
+        return budget
+
+    return budget / config.workerinput["workercount"]
+
+
+def journal_options(config) -> dict:
+    # Runs can only be resumed with the options they were started with
+    return {
+        "stream": bool(config.getoption("--stream")),
+        "use_system_prompt": bool(config.getoption("--use-system-prompt")),
+        "fail_fast_stream": config.getoption("--fail-fast-stream"),
+    }
+
+
+class RunResultCollector:
+    """
+    Collects the run results attached to test reports. With pytest-xdist, workers relay their reports to the
+    controller, so the results of every worker end up in the controller's session.
+
+    Every run is also written to the journal once its teardown is reported, together with its JSON report entry,
+    and the runs resumed from the journal are added back to the JSON report. The JSON report keeps the test cases of
+    runs in the compact form of the transcript store, which is added to the report as "transcripts".
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.run_results = config.run_results
+        self.resumed = config.resumed
+        self.transcripts = config.transcripts
+        self.journal = None if is_xdist_worker(config) else config.journal
+        self.models = {}
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_runtest_logreport(self, report):
+        run_result = getattr(report, "run_result", None)
+        if run_result is not None:
+            self.run_results[(report.nodeid, run_result["model"])] = run_result
+            self.models[report.nodeid] = run_result["model"]
+
+        # Runs after the JSON report plugin, which has then seen every stage of the test
+        if report.when == "teardown" and report.nodeid in self.models:
+            model = self.models.pop(report.nodeid)
+            run_result = self.run_results[(report.nodeid, model)]
+            test = self.json_test(report)
+            # The journal keeps complete test cases, so resumed runs don't depend on this session's transcripts
+            if self.journal is not None:
+                self.journal.append(report.nodeid, model, run_result, test)
+            if test is not None:
+                self.compact(test, run_result["spec_id"])
+
+    def compact(self, test: dict, spec_id: str):
+        metadata = test.get("metadata", {})
+        if self.transcripts is None or "test_case" not in metadata:
+            return
+
+        # In place, as the test item holds on to the same metadata
+        compact = self.transcripts.compact(spec_id, metadata.pop("test_case"))
+        rest = {key: metadata.pop(key) for key in list(metadata) if key != "model"}
+        metadata.update(compact)
+        metadata.update(rest)
+
+    @pytest.hookimpl(tryfirst=True, optionalhook=True)
+    def pytest_json_modifyreport(self, json_report):
+        self.add_resumed(json_report)
+        if self.transcripts is not None and self.transcripts.specs:
+            json_report["transcripts"] = self.transcripts.to_dict()
+
+    def add_resumed(self, json_report):
+        entries = [entry for entry in self.resumed.values() if entry["test"] is not None]
+        if not entries or "tests" not in json_report:
+            return
+
+        tests = []
+        for entry in entries:
+            self.compact(entry["test"], entry["run_result"]["spec_id"])
+            tests.append(entry["test"])
+
+        json_report["tests"].extend(tests)
+        summary = json_report["summary"]
+        summary["total"] = summary.get("total", 0) + len(tests)
+        for test in tests:
+            summary[test["outcome"]] = summary.get(test["outcome"], 0) + 1
+
+        # Resumed runs were deselected, but are reported like the runs of this session. With pytest-xdist, they were
+        # deselected on the workers, so the controller hasn't counted them as collected.
+        deselected = min(summary.get("deselected", 0), len(tests))
+        summary["collected"] = summary.get("collected", 0) + len(tests) - deselected
+        summary["deselected"] = summary.get("deselected", 0) - deselected
+        if not summary["deselected"]:
+            del summary["deselected"]
+
+    def json_test(self, report) -> dict | None:
+        # Only the JSON report plugin of the controller collects tests
+        tests = getattr(getattr(self.config, "_json_report", None), "_json_tests", None)
+        if tests is None:
+            return None
+        return tests.get(report.nodeid)
+
+
+class JsonlReporter:
+    """
+    Writes each test to the JSONL report once its teardown is reported, and then forgets it. With pytest-xdist, the
+    controller writes the test records that workers attach to their reports.
+    """
+
+    def __init__(self, writer: ReportWriter):
+        self.writer = writer
+        self.tests = {}
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_runtest_logreport(self, report):
+        test = self.tests.setdefault(report.nodeid, {"nodeid": report.nodeid, "outcome": "passed", "duration": 0.0})
+        test["duration"] += report.duration
+        if report.failed:
+            test["outcome"] = "failed" if report.when == "call" else "error"
+            crash = getattr(report.longrepr, "reprcrash", None)
+            test["message"] = crash.message if crash is not None else str(report.longrepr)
+        elif report.skipped:
+            test["outcome"] = "skipped"
+            if isinstance(report.longrepr, tuple):
+                test["message"] = report.longrepr[2]
+
+        test.update(getattr(report, "test_record", {}))
+        if report.when == "teardown":
+            self.writer.write(self.tests.pop(report.nodeid))
+
+
+def target_concurrency(config, target: Target) -> int:
+    return target.concurrency or config.getoption("--concurrency")
+
+
+def uses_asyncio_engine(config) -> bool:
+    # Hedged requests race each other on the event loop
+    return config.getoption("--defer-judging") or hedge_percentile(config) is not None or any(
+        target_concurrency(config, target) > 1 for target in config.targets
+    )
+
+
+def hedge_percentile(config) -> float | None:
+    # Recorded and replayed responses aren't hedged, duplicates would record twice and replay instantly
+    if config.getoption("--record") or config.getoption("--replay"):
+        return None
+    return config.getoption("--hedge-percentile")
+
+
+def new_model_client(config, target: Target, client_class=OpenAI, http_client=None):
+    return new_client(config, client_class, "model", target.base_url, target.resolve_api_key(), http_client)
+
+
+def new_judge_client(config, client_class=OpenAI, http_client=None):
+    return new_client(
+        config, client_class, "judge", os.getenv("OPENAI_BASE_URL"), os.getenv("OPENAI_API_KEY"), http_client
+    )
+
+
+def new_client(config, client_class, namespace: str, base_url: str | None, api_key: str | None, http_client=None):
+    # Async clients are given the event loop's HTTP client, sync clients share the session's
+    cassette = config.cassette
+    asynchronous = client_class is AsyncOpenAI
+    if cassette is not None and cassette.replay:
+        return CassetteClient(cassette, namespace, asynchronous=asynchronous)
+
+    # Retries are made by the retry policies, which tell infrastructure errors apart from model failures
+    client = client_class(
+        base_url=base_url,
+        api_key=api_key,
+        http_client=http_client or shared_http_client(config),
+        max_retries=0,
+    )
+    if cassette is not None:
+        return CassetteClient(cassette, namespace, client, asynchronous=asynchronous)
+
+    return client
+
+
+def shared_http_client(config) -> httpx.Client:
+    if config.http_client is None:
+        config.http_client = new_http_client(config.transport_options, config.connection_stats)
+    return config.http_client
+
+
+def new_model_rate_limiter(config, target: Target) -> RateLimiter:
+    requests_per_minute = target.rpm or config.getoption("--model-rpm")
+    request_delay = float(config.getoption("--request-delay"))
+    if requests_per_minute is None and request_delay > 0.0:
+        requests_per_minute = 60 / request_delay
+
+    tokens_per_minute = target.tpm or config.getoption("--model-tpm")
+    return RateLimiter(worker_share(config, requests_per_minute), worker_share(config, tokens_per_minute))
+
+
+def new_judge_rate_limiter(config) -> RateLimiter:
+    return RateLimiter(
+        worker_share(config, config.getoption("--judge-rpm")),
+        worker_share(config, config.getoption("--judge-tpm")),
+    )
+
+
+def retry_policy(config, name: str) -> RetryPolicy:
+    # One policy per target and one for the judge, so each hedges against the latencies of its own endpoint
+    if name not in config.retry_policies:
+        config.retry_policies[name] = RetryPolicy(
+            config.getoption("--max-retries"),
+            config.getoption("--retry-base-delay"),
+            config.getoption("--retry-max-delay"),
+            hedge_percentile(config),
+        )
+    return config.retry_policies[name]
+
+
+def model_retry_policy_name(target: Target) -> str:
+    return f"model {target.name}"
 
 
 @pytest.fixture(scope="session")
-def model_client():
-    api_key = os.getenv("FCTS_API_KEY")
-    base_url = os.getenv("FCTS_BASE_URL")
-    return OpenAI(base_url=base_url, api_key=api_key)
+def model_clients(pytestconfig) -> dict[str | None, OpenAI]:
+    return {}
+
+
+@pytest.fixture
+def model_client(pytestconfig, model_clients, target: Target):
+    # One client per target for the whole session
+    if target.name not in model_clients:
+        model_clients[target.name] = new_model_client(pytestconfig, target)
+    return model_clients[target.name]
 
 
 @pytest.fixture(scope="session")
-def judge_client():
-    api_key = os.getenv("OPENAI_API_KEY")
-    base_url = os.getenv("OPENAI_BASE_URL")
-    return OpenAI(base_url=base_url, api_key=api_key)
+def judge_client(pytestconfig):
+    return new_judge_client(pytestconfig)
 
 
 @pytest.fixture(scope="session")
-def model() -> str | None:
-    return os.getenv("FCTS_MODEL")
+def model_rate_limiters(pytestconfig) -> dict[str | None, RateLimiter]:
+    return {}
+
+
+@pytest.fixture
+def model_rate_limiter(pytestconfig, model_rate_limiters, target: Target) -> RateLimiter:
+    if target.name not in model_rate_limiters:
+        model_rate_limiters[target.name] = new_model_rate_limiter(pytestconfig, target)
+    return model_rate_limiters[target.name]
 
 
-# Assuming you have a fixture that receives `test_case` and `test_id` parameters
-@pytest.fixture(autouse=True)
-def attach_test_case_to_node(request, test_case):
-    request.node.test_case = test_case
+@pytest.fixture(scope="session")
+def judge_rate_limiter(pytestconfig) -> RateLimiter:
+    return new_judge_rate_limiter(pytestconfig)
+
 
+@pytest.fixture
+def model_retry_policy(pytestconfig, target: Target) -> RetryPolicy:
+    return retry_policy(pytestconfig, model_retry_policy_name(target))
 
+
+@pytest.fixture(scope="session")
+def judge_retry_policy(pytestconfig) -> RetryPolicy:
+    return retry_policy(pytestconfig, "judge")
+
+
+@pytest.fixture(scope="session")
+def judge_cache(pytestconfig) -> JudgeCache | None:
+    return pytestconfig.judge_cache
+
+
+@pytest.fixture
+def model(target: Target) -> str | None:
+    return target.model
+
+
+@pytest.fixture(scope="session")
+def fail_fast_stream(pytestconfig) -> bool:
+    return pytestconfig.getoption("--fail-fast-stream")
+
+
+@pytest.fixture(scope="session")
+def stream_usage(pytestconfig) -> bool:
+    return pytestconfig.getoption("--stream-usage")
+
+
+@pytest.fixture
+def test_case(request, spec: TestCase) -> TestCase:
+    # Per-run state is only created when the run starts (or is started by the asyncio engine), and released once
+    # it has been reported, so memory doesn't grow with --spec-run-count
+    if hasattr(request.node, "transcript"):
+        request.node.test_case = restore_run(request.node)
+    elif not hasattr(request.node, "test_case"):
+        request.node.test_case = spec.new_run()
+    return request.node.test_case
+
+
+def spec_id(item) -> str:
+    # The test ID without its run number
+    return item.callspec.params["test_id"].rsplit("-", 1)[0]
+
+
+def target_name(item) -> str:
+    return str(item.callspec.params["target"].name)
+
+
+def run_attributes(item) -> dict:
+    # What the spans of a run are tagged with
+    return {
+        "spec_id": spec_id(item),
+        "run": int(item.callspec.params["test_id"].rsplit("-", 1)[1]),
+        "model": target_name(item),
+    }
+
+
+def sample_id(item) -> str:
+    # Adaptive sampling decides for each spec and target separately
+    return f"{target_name(item)}/{spec_id(item)}"
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_setup(item):
+    sampler = item.config.sampler
+    if sampler is None or not hasattr(item, "callspec") or "spec" not in item.callspec.params:
+        return
+
+    # Runs driven up front by the asyncio engine were already sampled when they started
+    if hasattr(item, "conversation_error"):
+        if isinstance(item.conversation_error, ConversationSkipped):
+            pytest.skip(sampler.reason(sample_id(item)))
+        return
+
+    if sampler.done(sample_id(item)):
+        pytest.skip(sampler.reason(sample_id(item)))
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    if item.config.tracer is None or not hasattr(item, "callspec") or "spec" not in item.callspec.params:
+        yield
+        return
+
+    with tracing.attributes(**run_attributes(item)):
+        yield
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    yield
+    for name in ("test_case", "conversation_error", "transcript", "turns"):
+        item.__dict__.pop(name, None)
+
+
+@pytest.hookimpl(tryfirst=True)
 def pytest_collection_modifyitems(session, config, items):
     items.sort(key=lambda x: x.nodeid)
 
+    # With --dist=loadgroup, all runs of a spec go to the same xdist worker, whose sampler sees all their outcomes.
+    # The markers are added before pytest-xdist reads them in its own hook.
+    if config.sampler is not None and is_xdist_worker(config):
+        for item in items:
+            if hasattr(item, "callspec") and "spec" in item.callspec.params:
+                item.add_marker(pytest.mark.xdist_group(sample_id(item)))
+
+    if config.getoption("--resume"):
+        resume(config, items)
+
+
+def resume(config, items):
+    # Deselects the runs completed in the journal. Runs that ended in infrastructure errors are run again.
+    remaining, resumed = [], []
+    for item in items:
+        entry = None
+        if hasattr(item, "callspec") and "spec" in item.callspec.params:
+            entry = config.journal.get(item.nodeid, target_name(item))
+        if entry is None or entry["run_result"]["result"] == "ERROR":
+            remaining.append(item)
+            continue
+
+        resumed.append(item)
+        config.resumed[(item.nodeid, target_name(item))] = entry
+        if config.sampler is not None:
+            config.sampler.record(sample_id(item), item.nodeid, entry["run_result"]["result"] == "PASSED")
+
+    if resumed:
+        items[:] = remaining
+        config.hook.pytest_deselected(items=resumed)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtestloop(session):
+    if uses_asyncio_engine(session.config) and not session.config.option.collectonly:
+        run_concurrently(session)
+
+    yield
+
+
+def run_concurrently(session):
+    # Drive every conversation up front on an event loop, then let each test item report the stored outcome.
+    # The test items still run one after another, so reporting hooks see the same results as a sequential run.
+    items = [
+        item for item in session.items
+        if hasattr(item, "callspec") and "spec" in item.callspec.params
+    ]
+    if not items:
+        return
+
+    # Each target runs with its own client, rate limiter and concurrency limit, and they all share the judge
+    target_items = {}
+    for item in items:
+        target_items.setdefault(target_name(item), []).append(item)
+
+    async def run():
+        # The model and judge clients share one connection pool, which is closed once every target is done
+        http_client = new_http_client(session.config.transport_options, session.config.connection_stats, True)
+        async with http_client:
+            judge_client = new_judge_client(session.config, AsyncOpenAI, http_client)
+            judge_rate_limiter = new_judge_rate_limiter(session.config)
+            await asyncio.gather(*(
+                run_target(session, items, http_client, judge_client, judge_rate_limiter)
+                for items in target_items.values()
+            ))
+
+    asyncio.run(run())
+
+
+async def run_target(session, items, http_client, judge_client, judge_rate_limiter):
+    target = items[0].callspec.params["target"]
+    sampler = session.config.sampler
+    should_run, on_done = None, None
+    if sampler is not None:
+        # Start the n-th run of every spec before any spec's next run, so concurrent runs are spread across specs
+        # and each spec's outcomes arrive in time to stop it early
+        items.sort(key=lambda item: int(item.callspec.params["test_id"].rsplit("-", 1)[1]))
+
+        def should_run(index: int) -> bool:
+            return not sampler.done(sample_id(items[index]))
+
+        def on_done(index: int, error: BaseException | None):
+            # Infrastructure errors say nothing about the model's pass rate
+            if not isinstance(error, InfrastructureError):
+                sampler.record(sample_id(items[index]), items[index].nodeid, error is None)
+
+    model_client = new_model_client(session.config, target, AsyncOpenAI, http_client)
+    errors = await run_conversations_async(
+        (
+            traced(session.config, item, start_run(session.config, item, target))
+            for item in items
+        ),
+        model_client,
+        judge_client,
+        target_concurrency(session.config, target),
+        new_model_rate_limiter(session.config, target),
+        judge_rate_limiter,
+        session.config.getoption("--defer-judging"),
+        session.config.getoption("--judge-batch-size"),
+        should_run,
+        on_done,
+        retry_policy(session.config, model_retry_policy_name(target)),
+        retry_policy(session.config, "judge"),
+    )
+
+    for item, error in zip(items, errors):
+        item.conversation_error = error
+
+
+def start_run(config, item, target) -> Generator:
+    # The run's state is only created when the engine starts its conversation, under the target's concurrency
+    # limit, and runs that are skipped never create it
+    item.test_case = item.callspec.params["spec"].new_run()
+    try:
+        return (yield from converse(
+            item.test_case,
+            target.model,
+            item.callspec.params["stream"],
+            item.callspec.params["use_system_prompt"],
+            config.judge_cache,
+            config.getoption("--fail-fast-stream"),
+            config.getoption("--stream-usage"),
+        ))
+    finally:
+        finish_run(config, item)
+
+
+def finish_run(config, item):
+    # Puts the state of a finished run away in the transcript store until the run is reported, so only the runs in
+    # progress hold a whole transcript. The asyncio engine doesn't run on xdist workers, which have no store.
+    test_case = item.__dict__.pop("test_case")
+    dump = test_case.model_dump(mode="json", exclude={"actual": {"turns"}})
+    item.transcript = config.transcripts.compact(spec_id(item), dump)
+    item.turns = test_case.actual.turns
+
+
+def restore_run(item) -> TestCase:
+    # The run's state as it was when finish_run put it away
+    actual = item.config.transcripts.expand(item.__dict__.pop("transcript"))["actual"]
+    test_case = item.callspec.params["spec"].new_run()
+    test_case.actual = Actual.model_validate({**actual, "tools": [], "turns": item.__dict__.pop("turns")})
+    return test_case
+
+
+def traced(config, item, conversation):
+    # The conversations of a target share its driver's tasks, so each carries its run's span attributes with it
+    if config.tracer is None:
+        return conversation
+    return tracing.with_attributes(conversation, run_attributes(item))
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    if not hasattr(pyfuncitem, "conversation_error"):
+        return None
+
+    if pyfuncitem.conversation_error is not None:
+        raise pyfuncitem.conversation_error
+
+    return True
+
 
 def pytest_generate_tests(metafunc):
     if "test_case" in metafunc.fixturenames:
         spec_run_count = metafunc.config.getoption("--spec-run-count")
         spec_filter = metafunc.config.getoption("--spec-filter")
         spec_dir = metafunc.config.getoption("--spec-dir")
-        request_delay = float(metafunc.config.getoption("--request-delay"))
         stream = bool(metafunc.config.getoption("--stream"))
         use_system_prompt = bool(metafunc.config.getoption("--use-system-prompt"))
-        test_cases = load_test_cases(
-            spec_run_count,
-            spec_filter,
-            spec_dir,
-            request_delay,
-            stream,
-            use_system_prompt,
-        )
+        with tracing.span("load_test_cases", spec_dir=spec_dir, spec_filter=spec_filter):
+            test_cases = load_test_cases(
+                spec_run_count,
+                spec_filter,
+                spec_dir,
+                stream,
+                use_system_prompt,
+                metafunc.config.spec_cache,
+            )
+
+        # Every target runs every spec, and the test IDs only name the target when there are several
+        targets = metafunc.config.targets
         metafunc.parametrize(
-            "test_id, request_delay, stream, use_system_prompt, test_case",
-            test_cases,
-            ids=[test_id for test_id, _, _, _, _ in test_cases],
+            "test_id, stream, use_system_prompt, spec, target",
+            [test_case + (target,) for target in targets for test_case in test_cases],
+            ids=[
+                f"{target.name}-{test_id}" if len(targets) > 1 else test_id
+                for target in targets
+                for test_id, _, _, _ in test_cases
+            ],
         )
 
 
-def load_test_cases(
-    spec_run_count: int,
-    spec_filter: str,
-    spec_dir: str,
-    request_delay: float,
-    stream: bool,
-    use_system_prompt: bool,
-):
-    suite_test_cases = []
-    test_case_files = [
-        f for f in os.listdir(spec_dir) if f.endswith(".yaml") or f.endswith(".yml")
-    ]
-
-    for test_case_file in test_case_files:
-        file_path = os.path.join(spec_dir, test_case_file)
-        with open(file_path, "r") as file:
-            yaml_data = list(yaml.safe_load_all(file))
-
-        for index, item in enumerate(yaml_data):
-            try:
-                test_id = f"{test_case_file}-{index}"
-                if not fnmatch.fnmatch(test_id, spec_filter):
-                    continue
-
-                test_case = TestCase.parse_yaml(item)
-                for run in range(spec_run_count):
-                    suite_test_cases.append(
-                        (
-                            f"{test_id}-{run}",
-                            request_delay,
-                            stream,
-                            use_system_prompt,
-                            test_case.model_copy(deep=True),
-                        )
-                    )
-
-            except Exception as e:
-                print(f"Error parsing {test_case_file} at index {index}: {e}")
-
-    return suite_test_cases
-
-
 @pytest.hookimpl(optionalhook=True)
 def pytest_json_runtest_metadata(item, call):
     if call.when != "call":
         return {}
 
+    # The JSONL report holds the test cases and turns, so the JSON report doesn't keep them in memory
+    if item.config.getoption("--jsonl-report"):
+        return {"model": target_name(item), "start": call.start, "stop": call.stop}
+
     return {
-        "model": item.funcargs.get("model", "N/A"),
-        "test_case": item.test_case.model_dump(mode="json"),
+        "model": target_name(item),
+        "test_case": dump_test_case(item, passed=call.excinfo is None),
+        "turns": [turn.model_dump(mode="json") for turn in item.test_case.actual.turns],
         "start": call.start,
         "stop": call.stop,
     }
@@ -206,98 +1055,227 @@ def pytest_runtest_makereport(item, call):
             "Available Functions", json.dumps(available_functions, indent=4)
         )
         report.longrepr.addsection("Request Messages", json.dumps(messages, indent=4))
+        # The assistant messages of the responses are among the request messages already
+        responses = reference_messages(responses, messages, "Request Messages")
         report.longrepr.addsection("Raw Responses", json.dumps(responses, indent=4))
 
     # Pre-process results for aggregate CSV report
-    model = item.funcargs.get("model", "N/A")
-    result = "PASSED" if report.outcome == "passed" else "FAILED"
+    model = target_name(item)
+    infrastructure_error = call.excinfo is not None and call.excinfo.errisinstance(InfrastructureError)
+    result = "PASSED" if report.outcome == "passed" else "ERROR" if infrastructure_error else "FAILED"
     run_result = {
         "test_id": test_id,
+        "spec_id": spec_id(item),
         "categories": test_case.categories,
         "description": getattr(test_case, "description", "N/A"),
         "prompt": getattr(test_case, "prompt", "N/A"),
         "result": result,
         "model": model,
+        "start": call.start,
+        "stop": call.stop,
+        "turns": [turn.model_dump(mode="json") for turn in test_case.actual.turns if turn.target == "model"],
     }
 
-    if not hasattr(item.session.config, "run_results"):
-        item.session.config.run_results = {}
-    item.session.config.run_results[(item.nodeid, model)] = run_result
+    # Attached to the report so pytest-xdist relays it to the controller, see RunResultCollector
+    report.run_result = run_result
+
+    if item.config.getoption("--jsonl-report"):
+        report.test_record = {
+            "model": model,
+            "start": call.start,
+            "stop": call.stop,
+            "test_case": dump_test_case(item, passed=report.passed),
+            "turns": [turn.model_dump(mode="json") for turn in test_case.actual.turns],
+        }
+
+    if item.config.sampler is not None and not infrastructure_error:
+        item.config.sampler.record(sample_id(item), item.nodeid, report.outcome == "passed")
+
+
+def dump_test_case(item, passed: bool) -> dict:
+    # Passing runs keep up to --max-passing-responses raw responses in the reports
+    test_case = item.test_case.model_dump(mode="json", exclude={"actual": {"turns"}})
+    actual = test_case["actual"]
+    actual["tools"] = function_tools(test_case["available_functions"])
+    if passed:
+        actual["responses"] = cap_responses(actual["responses"], item.config.getoption("--max-passing-responses"))
+    return test_case
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if config.spec_cache is not None:
+        terminalreporter.write_sep("-", "spec cache")
+        terminalreporter.write_line(
+            f"{config.spec_cache.hits} hits, {config.spec_cache.misses} misses ({config.spec_cache.directory})"
+        )
+
+    if config.judge_cache is not None:
+        terminalreporter.write_sep("-", "judge cache")
+        terminalreporter.write_line(
+            f"{config.judge_cache.hits} hits, {config.judge_cache.misses} misses ({config.judge_cache.path})"
+        )
+
+    if config.report_writer is not None:
+        terminalreporter.write_sep("-", "jsonl report")
+        terminalreporter.write_line(f"{config.report_writer.records} tests written to {config.report_writer.path}")
+
+    if config.getoption("--resume"):
+        terminalreporter.write_sep("-", "journal")
+        terminalreporter.write_line(f"{len(config.resumed)} completed runs resumed from {config.journal.path}")
+        if config.journal.skipped:
+            terminalreporter.write_line(f"{config.journal.skipped} broken lines of the journal were skipped")
+    elif config.journal.path != config.getoption("--journal"):
+        terminalreporter.write_sep("-", "journal")
+        terminalreporter.write_line(
+            f"{config.getoption('--journal')} was in use by another session, runs were journaled to "
+            f"{config.journal.path}"
+        )
+
+    connection_lines = config.connection_stats.summary()
+    if connection_lines:
+        terminalreporter.write_sep("-", "http connections")
+        for line in connection_lines:
+            terminalreporter.write_line(line)
+        if config.transport_options.http2 and not HTTP2_AVAILABLE:
+            terminalreporter.write_line("HTTP/2 was requested, but isn't available without the h2 package")
+
+    if any(policy.retries or policy.hedges for policy in config.retry_policies.values()):
+        terminalreporter.write_sep("-", "retries")
+        for name, policy in sorted(config.retry_policies.items()):
+            if not (policy.retries or policy.hedges):
+                continue
+            terminalreporter.write_line(
+                f"{name}: {policy.retries} retries, {policy.hedges} hedged requests ({policy.hedge_wins} won)"
+            )
+
+    if config.tracer is not None:
+        terminalreporter.write_sep("-", "trace")
+        terminalreporter.write_line(f"{len(config.tracer.spans)} spans written to {config.getoption('--trace-file')}")
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_json_modifyreport(json_report):
+    # xdist workers report tests in the order they finish
+    if "tests" in json_report:
+        json_report["tests"].sort(key=lambda test: test["nodeid"])
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    # Add the resumed runs, the cache, connection and retry stats and the trace spans of a finished xdist worker to
+    # the controller's
+    workeroutput = getattr(node, "workeroutput", {})
+    for nodeid, model in workeroutput.get("resumed", []):
+        node.config.resumed[(nodeid, model)] = node.config.journal.get(nodeid, model)
+
+    for name, (hits, misses) in workeroutput.get("cache_stats", {}).items():
+        cache = getattr(node.config, name)
+        if cache is not None:
+            cache.hits += hits
+            cache.misses += misses
+
+    node.config.connection_stats.merge(workeroutput.get("connection_stats", {}))
+
+    for name, (retries, hedges, hedge_wins) in workeroutput.get("retry_stats", {}).items():
+        policy = retry_policy(node.config, name)
+        policy.retries += retries
+        policy.hedges += hedges
+        policy.hedge_wins += hedge_wins
+
+    if node.config.tracer is not None:
+        node.config.tracer.merge(workeroutput.get("trace_spans", []))
 
 
 def pytest_sessionfinish(session, exitstatus):
+    if is_xdist_worker(session.config):
+        session.config.workeroutput["cache_stats"] = {
+            name: (cache.hits, cache.misses)
+            for name in ("spec_cache", "judge_cache")
+            if (cache := getattr(session.config, name)) is not None
+        }
+        session.config.workeroutput["connection_stats"] = session.config.connection_stats.to_dict()
+        session.config.workeroutput["resumed"] = list(session.config.resumed)
+        session.config.workeroutput["retry_stats"] = {
+            name: (policy.retries, policy.hedges, policy.hedge_wins)
+            for name, policy in session.config.retry_policies.items()
+        }
+        if session.config.tracer is not None:
+            session.config.workeroutput["trace_spans"] = session.config.tracer.spans
+        return
+
+    with tracing.span("pytest_sessionfinish"):
+        write_results(session)
+
+    # Written last, so the trace covers the whole session including the workers' spans
+    if session.config.tracer is not None:
+        config = session.config
+        config.tracer.write(config.getoption("--trace-file"), config.getoption("--trace-format"))
+
+
+def write_results(session):
+    # Records the session's runs in the results store, exports the aggregate CSVs and writes the JSON reports
+    run_results = session.config.run_results
+    for key, entry in session.config.resumed.items():
+        run_results.setdefault(key, entry["run_result"])
     csv_path = session.config.getoption("--aggregate-summary-file")
-    aggregate_results = {}
-    columns = ["test_id", "categories", "description", "prompt"]  # Default fields
-    processed = set()  # Set to track processed test_id, model combinations
-
-    # Check if the CSV exists and read existing data
-    if os.path.exists(csv_path):
-        with open(csv_path, mode="r", newline="") as csvfile:
-            reader = csv.DictReader(csvfile)
-
-            columns = reader.fieldnames  # Capture all existing columns
-            for row in reader:
-                aggregate_results[row["test_id"]] = row
-
-    # Update test_results with new data from the current session
-    json_report_path = None
-    if hasattr(session.config, "run_results"):
-        for (nodeid, model), run_result in session.config.run_results.items():
-            if not json_report_path:
-                json_report_path = f"reports/{model}_report.json"
-
-            if model not in columns:
-                columns.append(
-                    model
-                )  # Add new model to fieldnames if it's not already there
-
-            # Extract the simplified test_id from nodeid
-            match = re.search(r"\[(.*?)-\d+\]", nodeid)
-            simplified_test_id = match.group(1) if match else nodeid
-            key = (simplified_test_id, model)
-
-            if simplified_test_id not in aggregate_results:
-                aggregate_results[simplified_test_id] = {c: "" for c in columns}
-                aggregate_results[simplified_test_id]["test_id"] = simplified_test_id
-                aggregate_results[simplified_test_id]["categories"] = ", ".join(
-                    run_result["categories"]
-                )
-                aggregate_results[simplified_test_id]["description"] = run_result[
-                    "description"
-                ]
-                aggregate_results[simplified_test_id]["prompt"] = run_result["prompt"]
-
-            # Check if this is the first run of this combination in the current session
-            if key not in processed:
-                # Reset the counts for the first run of this combination
-                passed, total_runs = 0, 0
-                processed.add(key)
-            else:
-                # Get current counts if not the first run
-                passed, total_runs = map(
-                    int,
-                    aggregate_results[simplified_test_id][model].split("/")
-                    if aggregate_results[simplified_test_id][model]
-                    else (0, 0),
-                )
-
-            # Increment runs and update pass rate for test spec
-            total_runs += 1
-            if run_result["result"] == "PASSED":
-                passed += 1
-
-            # Update the fraction in the CSV
-            aggregate_results[simplified_test_id][model] = f"{passed}/{total_runs}"
-
-    # Write the model's test report
-    if json_report_path:
-        plugin = session.config._json_report
-        plugin.save_report(json_report_path)
-
-    # Write updated data back to CSV
-    with open(csv_path, mode="w", newline="") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=columns)
-        writer.writeheader()
-        for test_id in sorted(aggregate_results.keys()):
-            writer.writerow(aggregate_results[test_id])
+
+    specs, runs = {}, []
+    for (nodeid, model), run_result in run_results.items():
+        specs[run_result["spec_id"]] = {
+            "test_id": run_result["spec_id"],
+            "categories": ", ".join(run_result["categories"]),
+            "description": run_result["description"],
+            "prompt": run_result["prompt"],
+        }
+        runs.append({
+            "model": str(model),
+            "test_id": run_result["spec_id"],
+            "run_id": nodeid,
+            "outcome": run_result["result"],
+            "start": run_result["start"],
+            "stop": run_result["stop"],
+            "turns": run_result["turns"],
+        })
+
+    # The aggregate CSVs are exports of the results store, which concurrent sessions can safely write to
+    store = ResultsStore(session.config.getoption("--results-db"))
+    try:
+        if store.empty() and os.path.exists(csv_path):
+            store.import_summary_csv(csv_path)
+        if runs:
+            store.record_session(specs.values(), runs)
+
+        store.export_summary_csv(
+            csv_path,
+            session.config.getoption("--adaptive-confidence"),
+            intervals=session.config.sampler is not None,
+            latency=session.config.getoption("--summary-latency"),
+        )
+        store.export_latency_csv(session.config.getoption("--aggregate-latency-file"))
+    finally:
+        store.close()
+
+    # Write each model's test report
+    models = sorted({run["model"] for run in runs})
+    plugin = session.config._json_report
+    if len(models) == 1:
+        plugin.save_report(f"reports/{models[0]}_report.json")
+        return
+
+    session_report = plugin.report
+    try:
+        for model in models:
+            plugin.report = model_report(session_report, model)
+            plugin.save_report(f"reports/{model}_report.json")
+    finally:
+        plugin.report = session_report
+
+
+def model_report(json_report, model: str):
+    # The session's JSON report narrowed down to the tests of one target
+    tests = [test for test in json_report.get("tests", []) if test.get("metadata", {}).get("model") == model]
+    summary = {"total": len(tests), "collected": len(tests)}
+    for test in tests:
+        summary[test["outcome"]] = summary.get(test["outcome"], 0) + 1
+
+    return {**json_report, "summary": summary, "tests": tests}